@@ -0,0 +1,523 @@
+### Benchmarks and consistency checks for the probability tables and the harmonizer
+
+# Usage: python benchmark.py [FILE...]
+# runs the consistency checks on the given score files, by default the first few Bach chorales, failing with an
+# AssertionError on the first mismatch. The benchmarks are run from the interpreter.
+
+import error
+import freqs
+import freqsarray
+import harmonize
+import histarray
+import modulation
+import random
+import os
+import shutil
+import snapshot
+import sys
+import time
+import tempfile
+import subprocess
+import numpy as np
+from music21 import corpus
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def lookups(indices):
+    '''
+    Return the set of lookups to compare for a sequence of full indices: the total, each prefix of each index, also
+    with None in place of its second entry, and their normalizations, along with a missing index.
+    '''
+    items = set([None, ('missing',), (True, 'missing')])
+    for index in indices:
+        for l in xrange(1, len(index) + 1):
+            for item in [index[:l], index[:1] + (None,) + index[2:l]]:
+                items.update([item, (True,) + item])
+    return items
+
+def checknorm(items, counts = 1):
+    '''
+    Add counts (a number or a sequence) to a Freq one index at a time and to a dense and a sparse ArrayFreq all at
+    once, at each of a sequence of full indices, and compare every lookup of lookups(items) in each ArrayFreq against
+    Freq, and the normalizations maintained by Freq against scanning through its table. Returns the list of
+    mismatched lookups.
+    '''
+    items = list(items)
+    f = freqs.Freq()
+    f.add(items, counts)
+    tables = [freqs.ArrayFreq(len(items[0]), sparse) for sparse in [False, True]]
+    for a in tables:
+        a.add(items, counts)
+    errors = []
+    for item in lookups(items):
+        if any(a[item] != f[item] for a in tables):
+            errors.append(item)
+        elif item and item[0] is True and len(item) > 1 and \
+             f[item] != freqs.Prob(f[item[1:]], f.scan(freqs.prefix(item[2:]))):
+            errors.append(item)
+    return errors
+
+def checkenv(filenames):
+    '''
+    Train a freqs environment with Freq tables and one with ArrayFreq tables on filenames, returning a dictionary from
+    each frequency table to the lookups of lookups(indices of the table) in which they differ.
+    '''
+    tables, arrays = freqs.Env(), freqs.Env(freqs.ArrayFreq)
+    tables.train(filenames)
+    arrays.train(filenames)
+    return dict((name, [item for item in lookups(getattr(tables, name).indices())
+                        if getattr(tables, name)[item] != getattr(arrays, name)[item]]) for name in freqs.TABLES)
+
+def importtimes(modules = ['music21', 'frequtils', 'freqs', 'freqsarray', 'histarray', 'harmonize', 'enharmonic']):
+    'Return the time in seconds taken to import each module in a new interpreter, including starting the interpreter.'
+    times = {}
+    for m in modules:
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', 'import ' + m], cwd = DIRECTORY)
+        times[m] = time.time() - start
+    return times
+
+def startuptime(module = 'freqsarray'):
+    '''
+    Return the time in seconds taken by a new interpreter to import module and obtain its shared environment through
+    gettable, which loads a snapshot if one has been saved and trains the environment otherwise.
+    '''
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'import %s; %s.gettable()' % (module, module)], cwd = DIRECTORY)
+    return time.time() - start
+
+def trainspeedup(filenames, workers = [1, 2, 4]):
+    '''
+    Train a freqsarray environment on filenames with each number of workers, returning a dictionary from the number of
+    workers to the training time in seconds and whether the trained Stats equal those trained by the first entry.
+    '''
+    filenames = list(filenames)
+    times, first = {}, None
+    for w in workers:
+        table = freqsarray.Env()
+        start = time.time()
+        table.train(filenames, workers = w)
+        stats = [getattr(table.stats, a) for a in freqsarray.STATS]
+        first = first or stats
+        times[w] = time.time() - start, all((a == b).all() for a, b in zip(stats, first))
+    return times
+
+def checkfolds(filenames, k = 4):
+    '''
+    Compare the environments given by the folds of a freqsarray environment trained on filenames against training a
+    new environment on the samples outside each fold. Returns the time in seconds taken by the folds and by retraining,
+    along with the largest difference between their Stats.
+    '''
+    table = freqsarray.Env()
+    table.train(filenames)
+    start = time.time()
+    folds = list(table.folds(k))
+    foldtime = time.time() - start
+    retraintime, difference = 0, 0
+    for fold, heldout in folds:
+        start = time.time()
+        retrained = freqsarray.Env()
+        retrained.train(f for f in table.samples if f not in fold)
+        retraintime += time.time() - start
+        difference = max([difference] + [abs(getattr(heldout.stats, a) - getattr(retrained.stats, a)).max()
+                                          for a in freqsarray.STATS])
+    return foldtime, retraintime, difference
+
+def checkcv(filenames, k = 4, seed = 0):
+    '''
+    Run error.kfoldcv on filenames into k folds, with the environments of the folds subtracted from one trained on
+    filenames and trained anew, returning the error and the time in seconds taken by each.
+    '''
+    results = []
+    for retrain in [False, True]:
+        start = time.time()
+        results += [error.kfoldcv(filenames, k, retrain = retrain, seed = seed), time.time() - start]
+    return tuple(results)
+
+def checksnapshot(filenames):
+    '''
+    Save the environments of freqs and freqsarray trained on filenames as snapshots, then load each and save it again to
+    the same path while its arrays are memory-mapped, and save a freqsarray environment loaded from a snapshot of all
+    but the last sample after training it on the last one. Returns the names of the arrays (the tables, for freqs) of
+    each resaved snapshot that differ from those first saved, which should be none.
+    '''
+    directory = tempfile.mkdtemp()
+    def contents(name, model):
+        # freqs tables are compared by their full indices, as the order of their nodes changes when loaded
+        if model == 'freqs':
+            env = freqs.Env.load(os.path.join(directory, name))
+            return dict((t, dict((i, getattr(env, t)[i]) for i in getattr(env, t).indices())) for t in freqs.TABLES)
+        return snapshot.load(os.path.join(directory, name), model)[1]
+    def differ(name, model):
+        arrays, expected = contents(name, model), contents(model, model)
+        equal = lambda a: np.array_equal(arrays[a], expected[a]) if model != 'freqs' else arrays[a] == expected[a]
+        return sorted(a for a in set(arrays) | set(expected) if a not in arrays or a not in expected or not equal(a))
+    results = {}
+    try:
+        for module in [freqs, freqsarray]:
+            name = module.__name__
+            path = os.path.join(directory, name + '.resaved')
+            env = module.Env()
+            env.train(filenames)
+            env.save(os.path.join(directory, name))
+            env.save(path)
+            module.Env.load(path).save(path)
+            results[name] = differ(name + '.resaved', name)
+        path = os.path.join(directory, 'freqsarray.trained')
+        env = freqsarray.Env()
+        env.train(filenames[:-1])
+        env.save(path)
+        env = freqsarray.Env.load(path) # without the Stats of each sample
+        env.train(filenames[-1:])
+        env.save(path)
+        results['freqsarray trained further'] = differ('freqsarray.trained', 'freqsarray')
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def checkdefaultcv(filenames):
+    '''
+    Run error.kfoldcv with its default arguments, on the shared freqsarray environment replaced by one loaded from a
+    snapshot of filenames without the Stats of each sample, returning its error along with that of kfoldcv on filenames.
+    As the default 10 folds hold out one sample each for fewer than 20 samples, the errors should be equal.
+    '''
+    directory = tempfile.mkdtemp()
+    table = snapshot.models.get('freqsarray')
+    try:
+        env = freqsarray.Env()
+        env.train(filenames)
+        env.save(directory)
+        freqsarray.settable(freqsarray.Env.load(directory))
+        default = error.kfoldcv()
+    finally:
+        if table is None:
+            snapshot.models.pop('freqsarray', None)
+        else:
+            freqsarray.settable(table)
+        shutil.rmtree(directory)
+    return default, error.kfoldcv(filenames)
+
+def logspeedup(melodies, key = None, voice = None):
+    '''
+    Harmonize each melody, a list of pitches, with exact and log-space probabilities, returning the total time in
+    seconds taken in each mode along with the indices of the melodies whose likeliest chord sequences differ.
+    '''
+    times, results = {}, {}
+    for exact in [True, False]:
+        start = time.time()
+        results[exact] = [harmonize.harmonize(m, key, voice, exact = exact)[:2] for m in melodies]
+        times[exact] = time.time() - start
+    return times[True], times[False], [i for i, (a, b) in enumerate(zip(results[True], results[False])) if a != b]
+
+def vectorspeedup(melodies, key = None, voice = None):
+    '''
+    Harmonize each melody, a list of pitches, with harmonize.viterbi and harmonize.viterbi_array in log space,
+    returning the time in seconds taken by each, the time taken to compute the tables of viterbi_array beforehand,
+    and the indices of the melodies whose results differ.
+    '''
+    start = time.time()
+    for k in ([key] if key else harmonize.frequtils.keys):
+        harmonize.tables(k, voice)
+    tabletime = time.time() - start
+    times, results = {}, {}
+    for f in [harmonize.viterbi, harmonize.viterbi_array]:
+        start = time.time()
+        results[f] = [f(m, key, voice) if f is harmonize.viterbi else f(map(freqsarray.Tone, m), key, voice)
+                      for m in melodies]
+        times[f] = time.time() - start
+    mismatches = [i for i, (a, b) in enumerate(zip(results[harmonize.viterbi], results[harmonize.viterbi_array]))
+                  if a[0] != b[0] or a[1] != b[1] or float(a[2]) != float(b[2])]
+    return times[harmonize.viterbi], times[harmonize.viterbi_array], tabletime, mismatches
+
+def batchthroughput(melodies, keys = None, sizes = [1, 8, 64]):
+    '''
+    Harmonize melodies, lists of pitches optionally in the given keys, with harmonize.harmonize one at a time and with
+    harmonize.harmonize_batch at each batch size, returning a dictionary from the batch size (None for one at a time)
+    to the number of melodies harmonized per second and whether the results equal those of harmonize.
+    The tables of the harmonizer are computed beforehand.
+    '''
+    keys = keys or [None] * len(melodies)
+    for k in set(keys):
+        for k in ([k] if k else harmonize.frequtils.keys):
+            harmonize.tables(k)
+    start = time.time()
+    first = [harmonize.harmonize(m, k) for m, k in zip(melodies, keys)]
+    rates = {None : (len(melodies) / (time.time() - start), True)}
+    for size in sizes:
+        start = time.time()
+        results = harmonize.harmonize_batch(melodies, keys, size = size)
+        rates[size] = len(melodies) / (time.time() - start), \
+                      all(a[0] == b[0] and a[1] == b[1] and float(a[2]) == float(b[2]) for a, b in zip(first, results))
+    return rates
+
+def beamtradeoff(melodies, key = None, beams = [None, 1, 2, 4, 8, 16], margins = [None]):
+    '''
+    Harmonize melodies, lists of pitches ideally from samples the environment was not trained on, with each beam
+    width and margin of harmonize.harmonize_batch, returning a dictionary from each pair of them to the time in seconds
+    taken and the fraction of melodies whose likeliest harmonization was pruned, i.e. differs from exact Viterbi.
+    '''
+    exact = harmonize.harmonize_batch(melodies, [key] * len(melodies))
+    results = {}
+    for beam in beams:
+        for margin in margins:
+            start = time.time()
+            pruned = harmonize.harmonize_batch(melodies, [key] * len(melodies), beam = beam, margin = margin)
+            results[beam, margin] = time.time() - start, \
+                sum(a[0] != b[0] or a[1] != b[1] for a, b in zip(exact, pruned)) / float(len(melodies))
+    return results
+
+def streamlatency(melodies, key = None, lags = [1, 4, 16]):
+    '''
+    Push the notes of each melody, a list of pitches, to a harmonize.StreamingHarmonizer with each lag, returning a
+    dictionary from the lag to the mean and maximum time in seconds taken by push and the fraction of chords which
+    differ from those of harmonize.harmonize. With a lag covering every melody, no chords should differ.
+    '''
+    offline = [harmonize.harmonize(m, key)[1] for m in melodies]
+    results = {}
+    for lag in lags + [max(map(len, melodies))]:
+        h = harmonize.StreamingHarmonizer(key, lag = lag)
+        times, differ = [], 0
+        for m, chords in zip(melodies, offline):
+            streamed = []
+            for n in m:
+                start = time.time()
+                streamed += h.push(n)
+                times.append(time.time() - start)
+            streamed += h.flush()
+            differ += sum(a is not b for a, b in zip(chords, streamed))
+        results[lag] = sum(times) / len(times), max(times), differ / float(sum(map(len, melodies)))
+    return results
+
+def memosizes(melodies, key = None, sizes = [1, 1 << 10, 1 << 16]):
+    '''
+    Harmonize melodies, lists of pitches, with exact probabilities looked up one at a time in the shared freqs
+    environment, with each capacity of its memoized probabilities, returning a dictionary from the capacity to the
+    time in seconds taken and the counters of the cache.
+    '''
+    table = freqs.gettable()
+    results = {}
+    for size in sizes:
+        table.memo = freqs.LRU(size)
+        start = time.time()
+        for m in melodies:
+            harmonize.viterbi(m, key, exact = True)
+        results[size] = time.time() - start, table.memo.stats()
+    return results
+
+def clithroughput(paths, command = 'findkey', workers = [1, 2, 4]):
+    '''
+    Run the command line interface on paths, score files, directories or glob patterns, with each number of workers,
+    returning a dictionary from the number of workers to the number of files processed per second, including startup.
+    '''
+    results = {}
+    for w in workers:
+        start = time.time()
+        out = subprocess.check_output([sys.executable, 'main.py', '-w', str(w), command] + list(paths), cwd = DIRECTORY)
+        results[w] = len(out.splitlines()) / (time.time() - start)
+    return results
+
+def findkeyspeedup(filenames):
+    '''
+    Find the key of every time slice of the samples in filenames, by the shared freqsarray environment, scoring one
+    histogram and key at a time by loglikelihood and all at once by findkey_batch, returning the number of slices,
+    the time in seconds taken by each and the fraction of slices whose keys differ.
+    '''
+    table = freqsarray.gettable()
+    hs = np.concatenate([freqsarray.Sample(f).get_matrix()[0] for f in filenames])
+    start = time.time()
+    looped = [max((histarray.loglikelihood(table, h, k), k) for k in freqsarray.keys)[1] for h in hs]
+    loop = time.time() - start
+    start = time.time()
+    batched = histarray.findkey_batch(table, hs)[1]
+    batch = time.time() - start
+    return len(hs), loop, batch, sum(a is not b for a, b in zip(looped, batched)) / float(len(hs))
+
+def windowspeedup(filenames, width = 8.0):
+    '''
+    Compute the histogram of the window of width quarter lengths centered on each time slice of the samples in
+    filenames by summing the slices of each window and by the differences of the cumulative histograms of
+    RangeHistograms, returning the time in seconds taken by each and whether their results agree.
+    '''
+    samples = map(freqsarray.Sample, filenames)
+    start = time.time()
+    summed = []
+    for s in samples:
+        m, ts = s.get_matrix()
+        summed += [m[(ts >= t - width / 2) & (ts < t + width / 2)].sum(axis=0) for t in ts]
+    loop = time.time() - start
+    start = time.time()
+    ranges = []
+    for s in samples:
+        h = histarray.RangeHistograms(s)
+        ranges.append(h.span(h.ts - width / 2, h.ts + width / 2))
+    prefix = time.time() - start
+    return loop, prefix, np.allclose(summed, np.concatenate(ranges))
+
+def matrixmemory(filenames):
+    '''
+    Return the bytes taken by the dense and sparse note matrices of the samples in filenames per 1000 samples, and
+    whether the Stats and the keys of each time slice found from both agree.
+    '''
+    dense = map(freqsarray.Sample, filenames)
+    sparse = [freqsarray.Sample(f, sparse=True) for f in filenames]
+    same = all((getattr(freqsarray.Stats(a), s) == getattr(freqsarray.Stats(b), s)).all()
+               for a, b in zip(dense, sparse) for s in freqsarray.STATS)
+    table = freqsarray.gettable()
+    same &= all(histarray.findkey_slices(table, a)[1] == histarray.findkey_slices(table, b)[1]
+                for a, b in zip(dense, sparse))
+    size = lambda samples: sum(s.get_matrix()[0].nbytes for s in samples) * 1000 / len(samples)
+    return size(dense), size(sparse), same
+
+def statstimes(filenames):
+    '''
+    Construct the Stats of the samples in filenames with the memoized chord functions of freqsarray.chordfunc cleared
+    and then filled, returning the mean time in seconds per sample for each.
+    '''
+    samples = map(freqsarray.Sample, filenames)
+    times = []
+    for cleared in [True, False]:
+        if cleared:
+            freqsarray.chordfuncs.clear()
+        start = time.time()
+        for s in samples:
+            freqsarray.Stats(s)
+        times.append((time.time() - start) / len(samples))
+    return tuple(times)
+
+def checkchordfuncs():
+    '''
+    Return the number of masks and keys for which the memoized freqsarray.chordfunc differs from Func of the music21
+    chord of the tones of the mask, taking -1 where Func raises ValueError as the root has no tone in the key.
+    '''
+    errors = 0
+    for mask in freqsarray.chordfuncs:
+        c = freqsarray.chord.Chord([freqsarray.Pitch(t) for t in xrange(freqsarray.T) if mask >> t & 1])
+        for k, funcs in zip(freqsarray.keys, freqsarray.chordfunc(mask)):
+            try:
+                f = freqsarray.Func(c, k)
+            except ValueError:
+                f = -1
+            errors += f != funcs
+    return errors
+
+def checkcodecs():
+    '''
+    Return the numbers of mismatches of encodetones against Tone for pitches of every step and alteration up to double
+    accidentals, of decodetones against Pitch for every tone, and of encodefuncs against functable, in every key.
+    '''
+    from music21 import pitch
+    ps = [pitch.Pitch(l, accidental=a, octave=o) for l in 'CDEFGAB' for a in (-2, -1, 0, 1, 2) for o in (3, 4, 5)]
+    steps, alters = freqsarray.pitcharrays(ps)
+    tones = np.arange(freqsarray.T)
+    roots = [c.root() for c in freqsarray.chords]
+    quals = [freqsarray.QUALITIES.index(c.quality) for c in freqsarray.chords]
+    errors = [0, 0, 0]
+    for k, key in enumerate(freqsarray.keys):
+        errors[0] += sum(t != freqsarray.Tone(p, key) for t, p in zip(freqsarray.encodetones(steps, alters, k), ps))
+        for p, s, a in zip(map(freqsarray.Pitch, tones, [key] * len(tones)), *freqsarray.decodetones(tones, k)):
+            errors[1] += p is not None and (p.diatonicNoteNum, p.alter) != (s, a)
+        rsteps, ralters = freqsarray.pitcharrays(roots)
+        errors[2] += (freqsarray.encodefuncs(rsteps, ralters, quals, k) != freqsarray.functable()[k]).sum()
+    return tuple(errors)
+
+def codectimes(n = 10 ** 6):
+    'Return the time in seconds taken to encode and decode the tones of n random pitches in random keys.'
+    steps, alters = np.random.randint(15, 50, n), np.random.randint(-1, 2, n).astype(float)
+    ks = np.random.randint(0, freqsarray.K, n)
+    start = time.time()
+    tones = freqsarray.encodetones(steps, alters, ks)
+    encode = time.time() - start
+    start = time.time()
+    freqsarray.decodetones(tones, ks)
+    return encode, time.time() - start
+
+def modulationtimes(filenames, n = 4):
+    '''
+    Identify modulation in the samples in filenames into at most n regions, by the shared freqsarray environment,
+    returning the time in seconds taken by one batched call of modulations and by calling modulation on each.
+    '''
+    table = freqsarray.gettable()
+    samples = map(freqsarray.Sample, filenames)
+    modulation.modulations(table, samples[:1], n) # build the tables used, which are cached
+    start = time.time()
+    modulation.modulations(table, samples, n)
+    batch = time.time() - start
+    start = time.time()
+    for s in samples:
+        modulation.modulation(table, s, n)
+    return batch, time.time() - start
+
+def checkmodulation(filename, n = 4):
+    '''
+    Identify modulation in the sample in filename into at most n regions by the shared freqsarray environment, returning
+    the regions found by modulation as a sorted list, and whether they differ from the initial even division.
+    '''
+    s = freqsarray.Sample(filename)
+    regions = sorted(modulation.modulation(freqsarray.gettable(), s, n).values())
+    l = len(histarray.RangeHistograms(s).offsets)
+    return regions, [(t0, t1) for t0, t1, _ in regions] != [(r * l / float(n), (r + 1) * l / float(n)) for r in xrange(n)]
+
+def segmenttimes(filenames, n = 4, penalty = 20.0):
+    '''
+    Divide the samples in filenames into regions in different keys by EM, by keypath with penalty and by partition into
+    at most n regions, returning for each the time in seconds taken for all of them and the mean log-likelihood of
+    the keys of the regions found per measure, each region being in its key for its whole range of measures.
+    Only EM may give different regions when run again.
+    '''
+    table = freqsarray.gettable()
+    lss, lk = modulation.loglikelihoods(table, map(freqsarray.Sample, filenames))
+    def regions(ls):
+        yield 'em', lambda: [(int(np.clip(np.ceil(t0), 0, len(ls))), int(np.clip(np.ceil(t1), 0, len(ls))),
+                              freqsarray.Key(k)) for t0, t1, k in modulation.em(ls, lk, n).values()]
+        yield 'viterbi', lambda: [(i, j, k) for i, j, k in partitionof(modulation.keypath(ls, lk, penalty)[0])]
+        yield 'partition', lambda: modulation.partition(ls, lk, n)[0]
+    def partitionof(ks):
+        starts = np.concatenate([[0], (ks[1:] != ks[:-1]).nonzero()[0] + 1])
+        return zip(starts, np.append(starts[1:], len(ks)), ks[starts])
+    results = {}
+    for ls in lss:
+        cum = np.vstack([np.zeros((1, ls.shape[1])), ls.cumsum(axis=0)])
+        for name, f in regions(ls):
+            start = time.time()
+            rs = f()
+            t, l = results.get(name, (0.0, 0.0))
+            results[name] = t + time.time() - start, l + sum(cum[j, k] - cum[i, k] for i, j, k in rs)
+    measures = sum(map(len, lss))
+    return dict((name, (t, l / measures)) for name, (t, l) in results.iteritems())
+
+def check(filenames, length = 8):
+    '''
+    Run the consistency checks on the samples in filenames, with the shared environments, asserting that no mismatches
+    are found, and harmonizing melodies of length notes from their top voices.
+    '''
+    filenames = list(filenames)
+    melodies = [list(freqs.Sample(f).notes(0))[:length] for f in filenames]
+    key = freqs.Sample(filenames[0]).key
+    items = [tuple(random.choice('abcdefg') for _ in xrange(d)) for d in [2, 3, 6] for _ in xrange(300)]
+    for d in [2, 3, 6]:
+        group = [i for i in items if len(i) == d]
+        errors = checknorm(group, [random.randint(1, 4) for _ in group])
+        assert not errors, 'ArrayFreq differs from Freq in %d lookups, e.g. %r' % (len(errors), errors[:3])
+    for name, errors in checkenv(filenames[:2]).iteritems():
+        assert not errors, '%s differs between Freq and ArrayFreq in %d lookups, e.g. %r' % (name, len(errors),
+                                                                                               errors[:3])
+    for name, differ in checksnapshot(filenames[:2]).iteritems():
+        assert not differ, '%s snapshot differs when resaved in arrays %r' % (name, differ)
+    folded, _, retrained, _ = checkcv(filenames)
+    assert folded == retrained, 'cross-validation error %g with folds subtracted, %g retrained' % (folded, retrained)
+    default, explicit = checkdefaultcv(filenames)
+    assert abs(default - explicit) < 1e-9, 'cross-validation error %g by default, %g given samples' % (default, explicit)
+    differ = logspeedup(melodies[:2], key)[2]
+    assert not differ, 'exact and log-space harmonizations differ for melodies %r' % differ
+    lag = max(map(len, melodies))
+    differ = streamlatency(melodies, key, [])[lag][2]
+    assert not differ, 'streamed chords differ from harmonize in a fraction %g with lag %d' % (differ, lag)
+    regions, moved = checkmodulation(corpus.getWork('bwv101.7')) # modulating from d minor to a minor and back
+    assert moved and len(set(k for _, _, k in regions)) > 1, 'EM kept its initial regions %r' % regions
+    map(freqsarray.Stats, map(freqsarray.Sample, filenames)) # memoizes the chord functions to check
+    errors = checkchordfuncs()
+    assert not errors, 'chordfunc differs from Func for %d masks and keys' % errors
+
+if __name__ == '__main__':
+    check(sys.argv[1:] or [str(f) for f in corpus.getBachChorales()[:4]])
+    print 'All checks passed.'
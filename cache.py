@@ -0,0 +1,215 @@
+### Content-addressed cache of data derived from parsing samples
+
+# Parsing a score with music21, chordifying it and analyzing its key dominate the time spent loading samples, so the
+# data derived from them is stored in DIRECTORY as an .npz file per sample, named after the hash of the file contents,
+# the music21 version and FEATURES, the version of the derived data, which should be incremented whenever it changes.
+# The least recently used entries are evicted once the cache grows beyond BUDGET bytes.
+
+import os
+import errno
+import hashlib
+import tempfile
+import numpy as np
+import music21
+from music21 import converter, key
+import snapshot
+
+DIRECTORY = os.environ.get('HARMONIZER_CACHE', os.path.join(snapshot.DIRECTORY, 'cache'))
+BUDGET = 1 << 30
+FEATURES = 1
+
+def entry(filename):
+    'Return the path of the cache entry of a file.'
+    h = hashlib.sha1('%s %s %d' % (snapshot.filehash(filename), music21.__version__, FEATURES))
+    return os.path.join(DIRECTORY, h.hexdigest() + '.npz')
+
+def sample(filename):
+    'Return the data derived from a sample file as a Parsed object, loading it from the cache if possible.'
+    path = entry(filename)
+    try:
+        os.utime(path, None) # mark as recently used
+        with np.load(path) as f:
+            return Parsed(dict(f.items()))
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT: # missing, or evicted by another process in the meantime
+            raise
+    arrays = derive(converter.parse(filename))
+    if not os.path.isdir(DIRECTORY):
+        os.makedirs(DIRECTORY)
+    fd, tmp = tempfile.mkstemp('.npz', '.tmp', DIRECTORY) # unique, as workers may derive the same file at once
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp, path) # so that concurrent readers never see partial entries
+    except:
+        os.remove(tmp)
+        raise
+    evict()
+    return Parsed(arrays)
+
+def evict(budget = None):
+    '''
+    Remove the least recently used entries of the cache until its total size is at most budget, by default BUDGET.
+    Entries removed by other processes evicting at the same time are skipped.
+    '''
+    budget = BUDGET if budget is None else budget
+    stats = []
+    for f in os.listdir(DIRECTORY):
+        if f.endswith('.npz') and '.tmp' not in f:
+            p = os.path.join(DIRECTORY, f)
+            try:
+                s = os.stat(p)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            stats.append((s.st_mtime, s.st_size, p))
+    stats.sort()
+    size = sum(s for _, s, _ in stats)
+    for _, s, p in stats:
+        if size <= budget:
+            break
+        try:
+            os.remove(p)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        size -= s
+
+def derive(s):
+    '''
+    Derive the cached data of a parsed score s: its note matrix and durations, the keys detected by the methods used by
+    each Sample class, the chordified events and the notes of each voice, along with the pitches they contain.
+    '''
+    import freqsarray # imported here, as freqsarray depends on this module
+    arrays = {}
+    arrays['matrix'], arrays['ts'] = freqsarray.matrix(s)
+
+    # keys as (tonic, mode) pairs, taking the analyzed key for the signature of scores without one, e.g. MIDI files
+    keys = [s.analyze('krumhansl'), s.analyze('key')]
+    signatures = s.flat.getElementsByClass('KeySignature')
+    if signatures:
+        ks = signatures[0]
+        keys.append(ks if isinstance(ks, key.Key) else ks.asKey(getattr(ks, 'mode', None) or 'major'))
+    else:
+        keys.append(keys[1])
+    arrays['keys'] = np.array([[k.tonic.name, k.mode] for k in keys], dtype = str)
+
+    pitches = []
+    def pitchindex(p):
+        pitches.append(p)
+        return len(pitches) - 1
+
+    # chordified events, with the pitches of chord i in pitches[start[i]:start[i+1]], and root -1 for rests
+    cs = list(s.chordify().flat.notesAndRests)
+    start, root = [0], []
+    for c in cs:
+        ps = c.pitches if c.isChord else []
+        start.append(start[-1] + len(ps))
+        for p in ps:
+            pitchindex(p)
+    for c in cs:
+        root.append(pitchindex(c.root()) if c.isChord else -1)
+    arrays['chord.offset']   = np.array([c.offset for c in cs], float)
+    arrays['chord.duration'] = np.array([c.quarterLength for c in cs], float)
+    arrays['chord.start']    = np.array(start)
+    arrays['chord.root']     = np.array(root, int)
+    arrays['chord.quality']  = np.array([c.quality if c.isChord else '' for c in cs], dtype = str)
+
+    # notes and rests of each voice, with pitch -1 for rests
+    voice, offset, duration, pitch = [], [], [], []
+    for v, part in enumerate(s.parts):
+        for n in part.flat.notesAndRests:
+            voice.append(v)
+            offset.append(n.offset)
+            duration.append(n.quarterLength)
+            pitch.append(pitchindex(n.pitches[0]) if not n.isRest else -1)
+    arrays['note.voice']    = np.array(voice, int)
+    arrays['note.offset']   = np.array(offset, float)
+    arrays['note.duration'] = np.array(duration, float)
+    arrays['note.pitch']    = np.array(pitch, int)
+
+    arrays['endtimes'] = np.array(s.flat.notesAndRests.stream()._uniqueOffsetsAndEndTimes(endTimesOnly=True), float)
+    arrays['measures'] = np.array([m.offset for m in s.parts[0].getElementsByClass('Measure')], float)
+
+    arrays['pitch.name']  = np.array([p.name for p in pitches], dtype = str)
+    arrays['pitch.step']  = np.array([p.diatonicNoteNum for p in pitches], int)
+    arrays['pitch.alter'] = np.array([p.alter for p in pitches], float)
+    arrays['pitch.ps']    = np.array([p.ps for p in pitches], float)
+    arrays['pitch.octave'] = np.array([p.implicitOctave for p in pitches], int)
+    return arrays
+
+class Pitch:
+    'Pitch restored from the cache, with the attributes of music21 pitches used by Tone, Func and the harmonizer.'
+    def __init__(self, name, step, alter, ps, octave):
+        self.name = name
+        self.diatonicNoteNum = step
+        self.alter = alter
+        self.ps = ps
+        self.pitchClass = int(round(ps)) % 12
+        self.octave = octave
+        self.nameWithOctave = '%s%d' % (name, self.octave)
+
+    def __repr__(self):
+        return '<cached pitch %s>' % self.nameWithOctave
+
+class Chord:
+    'Chord restored from the cache, with the attributes of music21 chords used by Func and the harmonizer.'
+    def __init__(self, pitches, root, quality, offset, duration):
+        self.pitches = pitches
+        self.quality = quality
+        self.offset = offset
+        self.quarterLength = duration
+        self.isChord = True
+        self._root = root
+
+    def root(self):
+        return self._root
+
+    def __repr__(self):
+        return '<cached chord %s>' % ' '.join(p.nameWithOctave for p in self.pitches)
+
+class Parsed:
+    'Data derived from a parsed sample, as returned by sample.'
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.matrix = arrays['matrix']
+        self.ts = arrays['ts']
+        self.endtimes = arrays['endtimes']
+        self.measures = arrays['measures']
+
+    def key(self, method = 'krumhansl'):
+        "Return the key of the sample detected by method, one of 'krumhansl', 'key' or 'signature'."
+        tonic, mode = self.arrays['keys'][['krumhansl', 'key', 'signature'].index(method)]
+        return key.Key(str(tonic), str(mode))
+
+    def pitch(self, i):
+        'Return the ith pitch of the sample.'
+        a = self.arrays
+        return Pitch(str(a['pitch.name'][i]), int(a['pitch.step'][i]), float(a['pitch.alter'][i]), float(a['pitch.ps'][i]),
+                     int(a['pitch.octave'][i]))
+
+    def chords(self, rests = False):
+        'Iterates through each chord of the chordified sample, with None for rests if included.'
+        a = self.arrays
+        start = a['chord.start']
+        for i, r in enumerate(a['chord.root']):
+            if r < 0:
+                if rests:
+                    yield None
+            else:
+                yield Chord(map(self.pitch, xrange(start[i], start[i+1])), self.pitch(r), str(a['chord.quality'][i]),
+                            a['chord.offset'][i], a['chord.duration'][i])
+
+    def voices(self):
+        'Return the number of voices of the sample.'
+        return int(self.arrays['note.voice'].max()) + 1 if len(self.arrays['note.voice']) else 0
+
+    def notes(self, voice, rests = False):
+        'Return the offsets, durations and pitches (None for rests, if included) of the notes of a voice.'
+        a = self.arrays
+        mask = a['note.voice'] == voice
+        if not rests:
+            mask &= a['note.pitch'] >= 0
+        return a['note.offset'][mask], a['note.duration'][mask], \
+               [self.pitch(p) if p >= 0 else None for p in a['note.pitch'][mask]]
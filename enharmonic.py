@@ -5,8 +5,6 @@ from music21 import *
 import itertools
 from harmonize import harmonize
 
-table = freqs.table
-
 class EnharmPitch(pitch.Pitch):
     'Empty subclass to mark enharmonically ambiguous pitches.'
     def __new__(cls, p):
@@ -36,12 +34,14 @@ def correct_enharm(filename): # might add more arguments for control
             np, cp = n, cs[i]
     return s # perhaps do more with the score
 
-def likeliest_enharm(n, np, nn, c, cp, cn, k):
+def likeliest_enharm(n, np, nn, c, cp, cn, k, exact = False):
     '''
     Estimate the likeliest enharmonic equivalent of the current note based on the previous and next notes, as well as
-    the previous, current and next chords.
+    the previous, current and next chords. Probabilities are computed as LogProbs, or as exact Probs if exact is True.
     '''
     # P(n = e | np, nn, c, cp, cn, k) = Z * P(n = e | np, cp, c, k) * P(nn | n = e, c, cn, k)
+    table = freqs.gettable()
+    log = not exact
     def prob(n, np, cp, c, k): # TODO np, cp can be None
         '''
         Return probability of current note given previous note, previous chord, current chord and key, 
@@ -50,19 +50,20 @@ def likeliest_enharm(n, np, nn, c, cp, cn, k):
         # P(n | theta) = P(n = e | theta) + P(n = e1 | theta)
         # P(n | n1, theta) = P(n | n1 = e, theta) * P(n1 = e | theta) + P(n | n1 = e1, theta) * P(n1 = e1 | theta)
         if n is None:
-            return freqs.Prob(1, 2)
+            return freqs.Prob(1, 2) if exact else freqs.LogProb(1, 2)
         if np is None:
             if isinstance(n, EnharmPitch):
-                return table.nprob(n, c, k) + table.nprob(n.getEnharmonic(), c, k)
-            return table.nprob(n, c, k)
+                return table.nprob(n, c, k, log = log) + table.nprob(n.getEnharmonic(), c, k, log = log)
+            return table.nprob(n, c, k, log = log)
         if isinstance(n, EnharmPitch):
             n1 = pitch.Pitch(n)
             return prob(n1, np, cp, c, k) + prob(n.getEnharmonic(), np, cp, c, k)
         if isinstance(np, EnharmPitch):
             n1 = pitch.Pitch(np)
             ne = np.getEnharmonic()
-            return prob(n, n1, cp, c, k) * table.nprob(n1, cp, k) + prob(n, ne, cp, c, k) * table.nprob(ne, cp, k)
-        return table.vprob(n, np, cp, c, k)
+            return prob(n, n1, cp, c, k) * table.nprob(n1, cp, k, log = log) + \
+                   prob(n, ne, cp, c, k) * table.nprob(ne, cp, k, log = log)
+        return table.vprob(n, np, cp, c, k, log = log)
     n = pitch.Pitch(n)
     n1 = n.getEnharmonic() # n is a pitch
     if prob(n1, np, cp, c, k) * prob(nn, n1, c, cn, k) > prob(n, np, cp, c, k) * prob(nn, n, c, cn, k):
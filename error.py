@@ -1,7 +1,10 @@
 # Computing the error rate of the harmonizer
 
 from harmonize import *
+from freqs import Freq
+import freqsarray
 import random
+import snapshot
 
 # TODO also test key
 def errorrate(sample):
@@ -10,28 +13,48 @@ def errorrate(sample):
     for v in voices(sample):
         cs = harmonize(list(sample.notes(v)), sample.key, v)[1]
         for c, c1 in zip(sample.chords(), cs):
-            p[c == c1] += 1
+            # the harmonizer only chooses triads, so compare the functions of the chords
+            p[Func(c, sample.key) == Func(c1, sample.key)] += 1
     return p[True, False] # probability of failure
 
-def kfoldcv(samples = None, k = 10):
-    'Run k-fold cross-validation on set of samples, returning average generalization error.'
-    global table
-    t = table # back up original table
+def kfoldcv(samples = None, k = 10, table = None, retrain = False, seed = None):
+    '''
+    Run k-fold cross-validation on set of samples, returning average generalization error.
+    The harmonizer is evaluated with the probabilities of freqsarray environments, which do not condition notes on
+    their voices yet, rather than those of the shared freqs environment it uses otherwise, as only freqsarray
+    environments can be untrained: table is a freqsarray environment trained on the samples, trained once if not given,
+    or the shared one if samples are not given either. The environment of each fold is obtained from it by subtracting
+    the statistics of the held out samples, or by training a new environment on its other samples if retrain is True,
+    giving the same error. The samples are shuffled by a random number generator seeded by seed.
+    '''
+    if table is None:
+        if samples:
+            table = freqsarray.Env()
+            table.train(samples)
+        else:
+            table = freqsarray.gettable()
     if not samples:
         samples = list(table.samples)
-    
+
     # shuffle samples randomly, to partition into k random blocks
-    random.shuffle(samples)
-    
-    # train table k times
+    samples = list(samples)
+    random.Random(seed).shuffle(samples)
+
+    t = snapshot.models.get('freqs') # back up original table, without loading it
     err = 0
-    n = len(samples) / k
-    for i in xrange(k+1): # k+1 to include rounding down
-        table = freqs.Env()
-        table.train(samples[:i*n] + samples[(i+1)*n:])
-        err += sum(errorrate(sample) for sample in samples[i*n:(i+1)*n])
-    table = t
-    return err / len(samples)
+    try:
+        for fold, heldout in table.folds(k, samples):
+            if retrain:
+                heldout = freqsarray.Env()
+                heldout.train(f for f in table.samples if f not in fold)
+            freqs.settable(heldout)
+            err += sum(errorrate(Sample(f)) for f in fold)
+    finally:
+        if t is None:
+            snapshot.models.pop('freqs', None)
+        else:
+            freqs.settable(t)
+    return float(err) / len(samples)
 
 def voices(sample):
     'Return the intersection of the voices of all chords in a given sample.'
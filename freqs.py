@@ -1,12 +1,23 @@
 from music21     import *
 from frequtils   import *
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from fractions   import Fraction
+import itertools
+import numpy as np
+import snapshot
+
+DENSE = 4 # maximum number of dimensions of an ArrayFreq stored as a dense array
+MEMO = 1 << 16 # maximum number of probabilities memoized by each Env
+
+TABLES = ['cfreq', 'tfreq', 'nfreq', 'vfreq', 'kfreq'] # frequency tables of Env
+TUPLES = {'func' : Func, 'tone' : Tone}              # tuple types of indices, for storing code tables
 
 class Freq:
     'Multiple dimensional frequency table.'
-    def __init__(self):
+    def __init__(self, ndim = None): # ndim unused, kept for compatibility with ArrayFreq
         self.table = {} # should have a None entry keeping count, and other entries frequency tables
         self.table[None] = 0 # perhaps subclass int for this
+        self.marg = {} # marg[rest] is the normalization factor of self[True, i, rest], maintained by __setitem__
     
     def __getitem__(self, item): 
         try:
@@ -17,18 +28,39 @@ class Freq:
             if item[0] is True: # normalization
                 if len(item) == 1:
                     return 1
-                s = 0
-                for i in self.table:
-                    if i is not None:
-                        s += self.table[i][item[2:]]
-                return Prob(self.__getitem__(item[1:]), s)
+                rest = prefix(item[2:])
+                if rest not in self.marg:
+                    self.marg[rest] = self.scan(rest)
+                return Prob(self.__getitem__(item[1:]), self.marg[rest])
             if item[0] not in [None, ()]:
                 return self.table[item[0]][item[1:]]
             return self.table[None]
         except KeyError:
             return 1 # Laplace smoothing
     
+    def scan(self, rest):
+        'Return the sum of self[i, rest] over every index i, by scanning through the table.'
+        s = 0
+        for i in self.table:
+            if i is not None:
+                s += self.table[i][rest]
+        return s
+    
     def __setitem__(self, item, value):
+        # record the entries of the updated child used by maintained normalization factors
+        child, rests, old = None, [], []
+        if item not in [None, ()]:
+            if not isinstance(item, tuple):
+                child, rest = item, ()
+            elif item[0] not in [None, ()]:
+                child, rest = item[0], prefix(item[1:])
+            if child is not None and child in self.table:
+                rests = [rest[:j] for j in xrange(len(rest) + 1) if rest[:j] in self.marg]
+                old = [self.table[child][r] for r in rests]
+            elif child is not None: # a new child contributes to every normalization factor
+                rests = list(self.marg)
+                old = [0] * len(rests)
+        
         val = self.__getitem__(item)
         if val == 1: # item not in table
             self.table[None] += value + 1 # Laplace smoothing
@@ -46,6 +78,16 @@ class Freq:
                     self.table[item[0]] = Freq()
                     self.table[item[0]][None] = 1
                 self.table[item[0]][item[1:]] = value
+        
+        for r, o in zip(rests, old):
+            self.marg[r] += self.table[child][r] - o
+    
+    def add(self, items, counts = 1):
+        'Add counts (a number or a sequence) to each of a sequence of indices.'
+        if np.isscalar(counts):
+            counts = itertools.repeat(counts)
+        for item, n in zip(items, counts):
+            self[item] += n
                 
     def __iter__(self):
         for i in self.table:
@@ -59,26 +101,383 @@ class Freq:
     def __int__(self):
         return self.table[None]
     
+    def indices(self):
+        'Iterate through the full indices stored in the table.'
+        for i in self:
+            if len(self.table[i]):
+                for rest in self.table[i].indices():
+                    yield (i,) + rest
+            else:
+                yield (i,)
+    
+    def dump(self):
+        'Return a dictionary of arrays storing the table as a list of nodes, with their parents, indices and totals.'
+        codes, nodes = Codes(), [self]
+        parents, indices, totals = [-1], [-1], [self.table[None]]
+        for n, f in enumerate(nodes): # breadth first, so that parents precede their children
+            for i in f:
+                nodes.append(f.table[i])
+                parents.append(n)
+                indices.append(codes.intern(i))
+                totals.append(f.table[i].table[None])
+        return {'parents' : np.array(parents), 'indices' : np.array(indices), 'totals' : np.array(totals, float),
+                'codes' : snapshot.encode(codes, TUPLES)}
+    
+    @staticmethod
+    def load(arrays):
+        'Construct a table from arrays returned by Freq.dump.'
+        values = snapshot.decode(arrays['codes'], TUPLES)
+        nodes = []
+        for p, i, t in zip(arrays['parents'], arrays['indices'], arrays['totals']):
+            f = Freq()
+            f.table[None] = count(t)
+            if p >= 0:
+                nodes[p].table[values[i]] = f
+            nodes.append(f)
+        return nodes[0]
+
+def prefix(item):
+    'Truncate an index at its first None, as the remaining entries do not affect lookups.'
+    for j, v in enumerate(item):
+        if v in [None, ()]:
+            return item[:j]
+    return item
+
+class Codes:
+    'Interning table assigning consecutive integer codes to values, such as Func, Tone, Key or voice values.'
+    def __init__(self, values = ()):
+        self.values = []
+        self.index  = {}
+        for v in values:
+            self.intern(v)
+    
+    def intern(self, value):
+        'Return the code of value, assigning a new code if value has not occurred before.'
+        try:
+            return self.index[value]
+        except KeyError:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+            return code
+    
+    def get(self, value):
+        'Return the code of value, or None if value has not occurred before.'
+        return self.index.get(value)
+    
+    def __getitem__(self, code):
+        return self.values[code]
+    def __iter__(self):
+        return iter(self.values)
+    def __len__(self):
+        return len(self.values)
+
+class LRU:
+    'Bounded cache evicting the least recently used entries, counting hits, misses and evictions.'
+    def __init__(self, size = MEMO):
+        self.size = size # at least 1
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self.generation = None # generation of the environment whose probabilities are cached
+    
+    def get(self, index, compute):
+        'Return the entry stored under index, storing compute() if there is none.'
+        try:
+            value = self.entries.pop(index)
+            self.hits += 1
+        except KeyError:
+            value = compute()
+            self.misses += 1
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+        self.entries[index] = value
+        return value
+    
+    def clear(self, generation = None):
+        'Remove every entry, e.g. when the environment is trained further.'
+        self.entries.clear()
+        self.generation = generation
+    
+    def stats(self):
+        'Return a dictionary of the counters of the cache, along with its size and capacity.'
+        return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+                'entries' : len(self.entries), 'size' : self.size}
+
+class ArrayFreq:
+    '''
+    Multiple dimensional frequency table indexed like Freq, storing counts in NumPy arrays of interned codes.
+    Tables of at most DENSE dimensions are stored as dense arrays, others as sparse coordinate lists.
+    As in Freq, missing entries count as 1 (Laplace smoothing), a None or omitted index sums over the remaining
+    dimensions and a leading True normalizes over the first dimension.
+    Totals are those of Freq, which adds the smoothing of each new index to the totals above it: each stored index
+    holds its count plus 2, so that the total of a stored prefix is the sum of those values plus 1, and of the whole
+    table just their sum, and self[index] += n gives the same values in both.
+    '''
+    def __init__(self, ndim, sparse = None):
+        self.ndim   = ndim
+        self.codes  = [Codes() for _ in xrange(ndim)] # interned values along each dimension
+        self.sparse = ndim > DENSE if sparse is None else sparse
+        # sums[codes] is the sum of the values of indices beginning with codes, and margs[codes] of indices whose
+        # codes after the first begin with codes, so that lookups do not have to sum over the table
+        if self.sparse:
+            self.index  = {}                      # maps code tuples to rows of coords and counts
+            self.coords = np.zeros((16, ndim), int)
+            self.counts = np.zeros(16)
+            self.size   = 0                       # number of rows in use
+            self.sums   = {}
+            self.margs  = {}
+        else:
+            self.counts = np.zeros((1,) * ndim)
+            self.accumulate()
+    
+    def __getitem__(self, item):
+        if item in [None, ()]:
+            return count(self.total(()))
+        if not isinstance(item, tuple):
+            item = (item,)
+        if item[0] is True: # normalization
+            if len(item) == 1:
+                return 1
+            return Prob(self[item[1:]], self.norm(item[2:]))
+        codes = self.lookup(item)
+        if codes is None:
+            return 1 # Laplace smoothing
+        if not codes:
+            return count(self.total(()))
+        return count(self.total(codes)) + 1 # also 1 for missing combinations of stored codes
+    
+    def __setitem__(self, item, value):
+        if not isinstance(item, tuple):
+            item = (item,)
+        if len(item) != self.ndim or any(v is None for v in item):
+            raise KeyError('ArrayFreq can only set entries of full indices')
+        self.add([item], value - self[item])
+    
+    def lookup(self, item, start = 0):
+        'Return the codes of item along dimensions start, start+1, ... up to its first None or (), or None if missing.'
+        codes = []
+        for c, v in zip(self.codes[start:], item):
+            if v in [None, ()]: # as in prefix
+                break
+            code = c.get(v)
+            if code is None:
+                return None
+            codes.append(code)
+        return tuple(codes)
+    
+    def total(self, codes):
+        'Return the sum of the values of the indices beginning with codes.'
+        if self.sparse:
+            return self.sums.get(codes, 0)
+        return self.sums[len(codes)][codes]
+    
+    def margin(self, codes):
+        'Return the sum of the values of the indices whose codes after the first begin with codes.'
+        if self.sparse:
+            return self.margs.get(codes, 0)
+        return self.margs[len(codes)][codes]
+    
+    def norm(self, rest):
+        'Return the sum of self[i, rest] over every value i of the first dimension.'
+        codes = self.lookup(rest, 1)
+        if codes is None:
+            return len(self) # every entry missing
+        return count(self.margin(codes)) + len(self)
+    
+    def add(self, items, counts = 1):
+        '''
+        Add counts (a number or an array) to each of a sequence of full indices, vectorized over the sequence, as
+        self[index] += count would. New indices also receive the 2 that Freq adds to the totals above them.
+        '''
+        items = map(truncate, items)
+        if not items:
+            return
+        codes = np.array([[c.intern(v) for c, v in zip(self.codes, item)] for item in items], int)
+        if codes.shape[1] != self.ndim:
+            raise KeyError('ArrayFreq can only set entries of full indices')
+        counts = np.broadcast_to(np.asarray(counts, float), (len(items),))
+        coords, inv = np.unique(codes, axis=0, return_inverse=True)
+        counts = np.bincount(inv, counts, len(coords))
+        # an index cut short by () is new only if its prefix is, as if it came first, as () and the rest of the index
+        # only affect the total of the prefix in Freq
+        cuts = np.empty(len(coords), int)
+        cuts[inv] = [len(prefix(item)) for item in items]
+        if self.sparse:
+            for coord, n, cut in zip(coords, counts, cuts):
+                coord = tuple(int(c) for c in coord)
+                if coord not in self.index and (cut == self.ndim or cut and coord[:cut] not in self.sums):
+                    n += 2
+                r = self.row(coord)
+                self.counts[r] += n
+                for l in xrange(self.ndim + 1):
+                    self.sums[coord[:l]] = self.sums.get(coord[:l], 0) + n
+                for l in xrange(1, self.ndim + 1):
+                    self.margs[coord[1:l]] = self.margs.get(coord[1:l], 0) + n
+        else:
+            self.grow()
+            new = self.counts[tuple(coords.T)] == 0 # stored indices are never 0
+            for r in (cuts < self.ndim).nonzero()[0]:
+                new[r] = cuts[r] and self.sums[cuts[r]][tuple(coords[r, :cuts[r]])] == 0
+            counts = counts + 2 * new
+            self.counts[tuple(coords.T)] += counts
+            self.sums[0]  += counts.sum()
+            self.margs[0] += counts.sum()
+            for l in xrange(1, self.ndim):
+                np.add.at(self.sums[l], tuple(coords[:, :l].T), counts)
+                np.add.at(self.margs[l], tuple(coords[:, 1:l+1].T), counts)
+    
+    def row(self, coord):
+        'Return the row of a code tuple in a sparse table, appending it if necessary.'
+        try:
+            return self.index[coord]
+        except KeyError:
+            if self.size == len(self.counts):
+                self.coords = np.concatenate([self.coords, np.zeros_like(self.coords)])
+                self.counts = np.concatenate([self.counts, np.zeros_like(self.counts)])
+            r = self.index[coord] = self.size
+            self.coords[r] = coord
+            self.size += 1
+            return r
+    
+    def grow(self):
+        'Enlarge a dense table to fit every interned code, doubling each dimension that overflows.'
+        shape = tuple(s if len(c) <= s else max(len(c), 2 * s) for s, c in zip(self.counts.shape, self.codes))
+        if shape != self.counts.shape:
+            counts = np.zeros(shape)
+            counts[tuple(slice(s) for s in self.counts.shape)] = self.counts
+            self.counts = counts
+            self.accumulate()
+    
+    def accumulate(self):
+        'Recompute the partial sums of the table from its counts.'
+        n = self.ndim
+        if self.sparse:
+            coords, counts = self.coords[:self.size], self.counts[:self.size]
+            self.sums  = {() : counts.sum()}
+            self.margs = {() : counts.sum()}
+            if self.size:
+                for l in xrange(1, n + 1):
+                    self.sums.update(partial(coords[:, :l], counts))
+                for l in xrange(1, n):
+                    self.margs.update(partial(coords[:, 1:l+1], counts))
+        else:
+            self.sums  = [self.counts.sum(axis=tuple(xrange(l, n))) for l in xrange(n)] + [self.counts]
+            self.margs = [self.counts.sum(axis=(0,) + tuple(xrange(l + 1, n))) for l in xrange(n)]
+    
+    def indices(self):
+        'Iterate through the full indices stored in the table.'
+        if self.sparse:
+            coords = self.coords[:self.size][self.counts[:self.size] != 0]
+        else:
+            coords = np.argwhere(self.counts)
+        for coord in coords:
+            yield tuple(c[i] for c, i in zip(self.codes, coord))
+    
+    def dump(self):
+        'Return a dictionary of arrays storing the table, its counts, coordinates if sparse and code tables.'
+        arrays = dict(('codes%d' % d, snapshot.encode(c, TUPLES)) for d, c in enumerate(self.codes))
+        if self.sparse:
+            arrays['coords'] = self.coords[:self.size]
+            arrays['counts'] = self.counts[:self.size]
+        else:
+            arrays['counts'] = self.counts
+        return arrays
+    
+    @staticmethod
+    def load(arrays):
+        'Construct a table from arrays returned by ArrayFreq.dump. Counts of dense tables are used without copying.'
+        ndim = sum(1 for name in arrays if name.startswith('codes'))
+        f = ArrayFreq(ndim, 'coords' in arrays)
+        f.codes = [Codes(snapshot.decode(arrays['codes%d' % d], TUPLES)) for d in xrange(ndim)]
+        if f.sparse:
+            f.coords = np.array(arrays['coords'], int).reshape(-1, ndim)
+            f.counts = np.array(arrays['counts'], float)
+            f.size   = len(f.counts)
+            f.index  = dict((tuple(c), r) for r, c in enumerate(f.coords.tolist()))
+        else:
+            f.counts = arrays['counts']
+        f.accumulate()
+        return f
+    
+    def __iter__(self):
+        return iter(self.codes[0])
+    def __len__(self):
+        return len(self.codes[0])
+    
+    def __index__(self):
+        return int(self.total(()))
+    def __int__(self):
+        return int(self.total(()))
+
+def truncate(item):
+    'Replace the entries of an index from its first () on by (), as Freq ignores them.'
+    p = prefix(item)
+    return p + ((),) * (len(item) - len(p))
+
+def partial(coords, counts):
+    'Return a dictionary from each distinct row of coords to the total of its counts.'
+    rows, inv = np.unique(coords, axis=0, return_inverse=True)
+    return dict(zip(map(tuple, rows.tolist()), np.bincount(inv, counts, len(rows))))
+
+def count(x):
+    'Convert a count stored in an array to an exact number, as expected by Prob.'
+    x = float(x)
+    return int(x) if x.is_integer() else Fraction(x)
+    
 class Env:
     '''
     Program environment containing probabilities for each chord, note and transition, acquired from sample chord sequences.
     '''
-    def __init__(self):
-        # Frequency tables    Properties tabulated                  Argument types (current always precedes previous)
-        self.cfreq = Freq() # chord function                        Func, Sample
-        self.tfreq = Freq() # chord transition                      Func, Func, Sample
-        self.nfreq = Freq() # note function in each chord function  Tone, Func, Voice, Sample
-        self.vfreq = Freq() # note transition                       Tone, Tone, Func, Func, Voice, Sample
-        self.kfreq = Freq() # marginal distribution of keys         Key
+    def __init__(self, freq = Freq):
+        'Create an empty environment whose frequency tables have type freq, e.g. Freq or ArrayFreq.'
+        # Frequency tables     Properties tabulated                  Argument types (current always precedes previous)
+        self.cfreq = freq(2) # chord function                        Func, Sample
+        self.tfreq = freq(3) # chord transition                      Func, Func, Sample
+        self.nfreq = freq(4) # note function in each chord function  Tone, Func, Voice, Sample
+        self.vfreq = freq(6) # note transition                       Tone, Tone, Func, Func, Voice, Sample
+        self.kfreq = freq(1) # marginal distribution of keys         Key
         self.samples = set()
+        self.hashes  = {}    # content hashes of samples, loaded from snapshots
+        self.generation = 0  # incremented whenever the environment is trained, e.g. to invalidate cached tables
+        self.memo = LRU()    # memoized probabilities, see memoized
     
-    def train(self, filenames):
+    def train(self, filenames, verbose = False):
         'Train probabilities from given iterator of filenames, for example corpus.getBachChorales().'
         for f in filenames:
-            s = Sample(f)
-            if s not in self.samples:
-                print 'Processing %s...' % f
-                self.process(s)
+            if f not in self.samples:
+                if verbose:
+                    print 'Processing %s...' % f
+                self.process(Sample(f))
+    
+    def save(self, path):
+        'Save the environment as a snapshot in directory path, to be loaded by Env.load.'
+        arrays = {}
+        for name in TABLES:
+            for a, v in getattr(self, name).dump().iteritems():
+                arrays[name + '.' + a] = v
+        samples = dict((f, self.hashes.get(f)) for f in (getattr(s, 'filename', s) for s in self.samples))
+        snapshot.save(path, 'freqs', arrays, samples,
+                      tables = dict((name, getattr(self, name).__class__.__name__) for name in TABLES))
+    
+    @classmethod
+    def load(cls, path, validate = False):
+        '''
+        Load an environment saved by Env.save from directory path, optionally checking that the files of its samples
+        have not changed since. The environment can be trained further on new samples.
+        '''
+        manifest, arrays = snapshot.load(path, 'freqs')
+        if validate:
+            changed = snapshot.validate(manifest)
+            if changed:
+                raise ValueError('samples changed since snapshot %s was saved: %s' % (path, ', '.join(changed)))
+        env = cls()
+        for name, kind in manifest['tables'].iteritems():
+            name = str(name)
+            sub = dict((a[len(name)+1:], v) for a, v in arrays.iteritems() if a.startswith(name + '.'))
+            setattr(env, name, {'Freq' : Freq, 'ArrayFreq' : ArrayFreq}[kind].load(sub))
+        env.hashes  = snapshot.samples(manifest)
+        env.samples = set(env.hashes)
+        return env
     
     def process(self, sample):
         'Update probabilities based on a sample sequence of chords.'
@@ -91,53 +490,78 @@ class Env:
         
         # add sample to samples
         self.samples.add(sample)
+        self.generation += 1
         
+        # collect indices first, so that array tables can be updated all at once
+        cs, ts, ns, vs = [], [], [], []
         prev = None
         for curr in sample.chords():
             f, f1 = Func(curr, key), Func(prev, key)
-            self.cfreq[f, sample] += 1     
-            self.tfreq[f, f1, sample] += 1 
+            cs.append((f, sample))
+            ts.append((f, f1, sample))
             for voice, n in enumerate(curr.pitches): # TODO sort pitches first
                 try:
                     n1 = prev.pitches[voice] # what if multiple notes are played on the same chord? consider ties
                     t, t1 = Tone(n, key), Tone(n1, key)
-                    self.nfreq[t, f, voice, sample] += 1
-                    self.vfreq[t, t1, f, f1, voice, sample] += 1
+                    ns.append((t, f, voice, sample))
+                    vs.append((t, t1, f, f1, voice, sample))
                 except:
                     pass
             prev = curr
+        self.cfreq.add(cs)
+        self.tfreq.add(ts)
+        self.nfreq.add(ns)
+        self.vfreq.add(vs)
+    
+    # probabilities are memoized by the codes of their arguments, and returned as LogProbs if log is True
     
-    # TODO memoize the following
+    def memoized(self, index, compute):
+        'Return compute(), memoized under index until the environment is trained further.'
+        if self.memo.generation != self.generation:
+            self.memo.clear(self.generation)
+        return self.memo.get(index, compute)
     
-    def kprob(self, k):
-        'kprob(k) -> Return probability of key k.'
-        return self.kfreq[True, k]
+    def kprob(self, k, log = False):
+        'kprob(k[, log]) -> Return probability of key k.'
+        p = self.memoized(('k', k.tonic.name, k.mode), lambda: self.kfreq[True, k])
+        return LogProb(p) if log else p
     
-    def cprob(self, c, k):
-        'cprob(c, k) -> Return probability of chord c occurring in key k.'
-        return self.cfreq[True, Func(c, k)]
+    def cprob(self, c, k, log = False):
+        'cprob(c, k[, log]) -> Return probability of chord c occurring in key k.'
+        f = Func(c, k)
+        p = self.memoized(('c', f), lambda: self.cfreq[True, f])
+        return LogProb(p) if log else p
     
-    def nprob(self, n, c, k, v = None):
-        'nprob(n, c, k[, v]) -> Return probability of note n occurring in voice v of chord c in key k.'
-        return self.nfreq[True, Tone(n, k), Func(c, k), v] # should normalize over v if not none
+    def nprob(self, n, c, k, v = None, log = False):
+        'nprob(n, c, k[, v, log]) -> Return probability of note n occurring in voice v of chord c in key k.'
+        t, f = Tone(n, k), Func(c, k)
+        p = self.memoized(('n', t, f, v), lambda: self.nfreq[True, t, f, v]) # should normalize over v if not none
+        return LogProb(p) if log else p
     
-    def tprob(self, c1, c, k, vel = None):
-        'tprob(c1, c, k[, vel]) -> Return probability of chord c changing to chord c1 in key k under harmonic velocity vel.'
+    def tprob(self, c1, c, k, vel = None, log = False):
+        'tprob(c1, c, k[, vel, log]) -> Return probability of chord c changing to chord c1 in key k under harmonic velocity vel.'
         if c == c1:
-            return self.cprob(c, k) # perhaps dependent on vel
+            return self.cprob(c, k, log) # perhaps dependent on vel
         f, f1 = Func(c, k), Func(c1, k)
-        return self.tfreq[True, f1, f, s]
+        p = self.memoized(('t', f1, f), lambda: self.tfreq[True, f1, f, None]) # summed over samples
+        return LogProb(p) if log else p
     
-    def vprob(self, n1, n, c1, c, k, v = None, vel = None):
-        '''vprob(n1, n, c1, c, k[, v, vel]) -> 
+    def vprob(self, n1, n, c1, c, k, v = None, vel = None, log = False):
+        '''vprob(n1, n, c1, c, k[, v, vel, log]) -> 
         Return probability of note n in chord c changing to note n1 in chord c1 
         in key k and voice v under harmonic velocity vel.'''
         if n == n1 and c == c1:
-            return self.nprob(n, c, k, v) # perhaps dependent on vel
+            return self.nprob(n, c, k, v, log) # perhaps dependent on vel
         f, f1 = Func(c, k), Func(c1, k)
         t, t1 = Tone(n, k), Tone(n1, k)
-        return self.vfreq[True, t1, t, f1, f, v, s]
+        p = self.memoized(('v', t1, t, f1, f, v), lambda: self.vfreq[True, t1, t, f1, f, v, None]) # summed over samples
+        return LogProb(p) if log else p
+
+def gettable():
+    'Return the shared environment, loading its snapshot or training it on the Bach chorales on first use.'
+    return snapshot.model('freqs', Env, corpus.getBachChorales)
+
+def settable(table):
+    'Replace the shared environment, e.g. by one trained on a subset of samples.'
+    snapshot.models['freqs'] = table
 
-# TODO load table from file, if possible
-table = Env()
-table.train(corpus.getBachChorales())
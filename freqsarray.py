@@ -2,10 +2,15 @@
 
 from music21 import *
 import numpy as np
+import itertools
+import multiprocessing
+import snapshot
+import cache
+import frequtils
 
 tones = [n + a for n in 'CDEFGABcdefgab' for a in ['-', '#', '']]
 keys = map(key.Key, tones)
-chords = [chord.Chord(map(k.pitches.__getitem__, [0, 2, 4])) for k in keys] # TODO does not include diminished
+chords = frequtils.chords # the same triads, whose qualities frequtils computes once; TODO does not include diminished
 notes = [n for n in tones if n[0].isupper()]
 K, C, N = len(keys), len(chords), len(notes)
 
@@ -15,11 +20,14 @@ N = T = 7*7
 # vectorize these
 # may also use music21.roman later
 
+scale = frequtils.scale # pitches of the scale of a key, computed once for each key
+
 def Func(chord, key=key.Key('C')):
     try:
         num = int(chord.root().diatonicNoteNum - key.tonic.diatonicNoteNum) % 7
-        acc = int(chord.root().ps - key.pitches[num].ps + 3) % 12 # assuming only 5 different types of accidentals occur
-        qual = ['major','minor','diminished','augmented', 'other'].index(chord.quality) % 4
+        acc = int(chord.root().ps - scale(key)[num].ps + 3) % 12 # assuming only 5 different types of accidentals occur
+        quality = frequtils.qualities.get(id(chord)) or chord.quality
+        qual = ['major','minor','diminished','augmented', 'other'].index(quality) % 4
         return np.ravel_multi_index((num, acc, qual), (7, 7, 4))
     except AttributeError:
         return -1
@@ -32,27 +40,114 @@ def Chord(func, key=key.Key('C')):
 def Tone(note, key=key.Key('C')): # if no key, use absolute value
     try:
         num = int(note.diatonicNoteNum - key.tonic.diatonicNoteNum) % 7
-        acc = int(note.ps - key.pitches[num].ps + 3) % 12
+        acc = int(note.ps - scale(key)[num].ps + 3) % 12
         return np.ravel_multi_index((num, acc), (7, 7)) # store accidental
-    except:
+    except (AttributeError, ValueError): # no pitch or accidental out of range
         return -1
 
 def Pitch(tone, key=key.Key('C')):
     try:
         num, acc = np.unravel_index(tone, (7,7))
-        p = key.pitches[num]
+        p = scale(key)[num]
         return pitch.Pitch(p.name[0], accidental=p.alter+acc-3)
-    except:
+    except (ValueError, pitch.AccidentalException): # tone or accidental out of range
         return None
 
-abs2func_tone = np.array([[Tone(Pitch(t, k)) for t in xrange(T)] for k in keys])
-func2abs_tone = np.array([[Tone(Pitch(t), k) for t in xrange(T)] for k in keys])
+abs2func_tone = func2abs_tone = None # KxT arrays converting tones between keys, built by tonetables on first use
+
+def tonetables():
+    'Return the arrays abs2func_tone and func2abs_tone, building them on first use.'
+    global abs2func_tone, func2abs_tone
+    if abs2func_tone is None:
+        abs2func_tone = np.array([[Tone(Pitch(t, k)) for t in xrange(T)] for k in keys])
+        func2abs_tone = np.array([[Tone(Pitch(t), k) for t in xrange(T)] for k in keys])
+    return abs2func_tone, func2abs_tone
+
+chord2func = None # KxC array of the function of each triad of chords in each key, built by functable on first use
+
+def functable():
+    'Return the array chord2func, building it on first use.'
+    global chord2func
+    if chord2func is None:
+        # the qualities of music21 chords are slow to compute, so compute them once for each chord
+        cs = [cache.Chord(c.pitches, c.root(), c.quality, 0, 0) for c in chords]
+        chord2func = np.array([[Func(c, k) for c in cs] for k in keys])
+    return chord2func
+
+# array versions of Tone, Func and Pitch, on the diatonic steps and alterations of pitches as in music21 and indices
+# of keys in keys, touching music21 only to build the scale tables and to convert pitches at the boundary
+
+QUALITIES = ['major', 'minor', 'diminished', 'augmented'] # of chords, by code in Func
+CMAJOR = keys.index(key.Key('C')) # index of the key of absolute tones
+PITCHSPACES = np.array([0, 2, 4, 5, 7, 9, 11]) # of the natural pitches of each step in an octave from C
+scalesteps = scaleps = scalealters = None # Kx7 arrays of the scale pitches of each key, built by scaletables on first use
+
+def scaletables():
+    'Return the arrays scalesteps, scaleps and scalealters, building them on first use.'
+    global scalesteps, scaleps, scalealters
+    if scalesteps is None:
+        ps = [scale(k)[:7] for k in keys]
+        scalesteps = np.array([[p.diatonicNoteNum for p in s] for s in ps])
+        scaleps = np.array([[p.ps for p in s] for s in ps])
+        scalealters = np.array([[p.alter for p in s] for s in ps])
+    return scalesteps, scaleps, scalealters
+
+def pitcharrays(pitches):
+    'Return the arrays of the diatonic steps and alterations of a sequence of music21 or cached pitches.'
+    return np.array([p.diatonicNoteNum for p in pitches], int), np.array([p.alter for p in pitches], float)
+
+def topitches(steps, alters):
+    'Return the music21 pitches of arrays of diatonic steps and alterations, with None for negative steps.'
+    return [pitch.Pitch('CDEFGAB'[(s - 1) % 7], accidental=a, octave=(s - 1) / 7) if s >= 0 else None
+            for s, a in zip(steps, alters)]
+
+def encodetones(steps, alters, ks=CMAJOR):
+    '''
+    Return the array of Tone of pitches in keys, given arrays of their diatonic steps and alterations and of the
+    indices of the keys, or one index for all of them, by default that of C major for absolute tones.
+    '''
+    steps, alters = np.asarray(steps), np.asarray(alters)
+    tsteps, tps, _ = scaletables()
+    num = (steps - tsteps[ks, 0]) % 7
+    ps = 12 * ((steps - 1) // 7 + 1) + PITCHSPACES[(steps - 1) % 7] + alters
+    acc = np.trunc(ps - tps[ks, num] + 3).astype(int) % 12 # assuming only 5 different types of accidentals occur
+    return np.where(acc < 7, num * 7 + acc, -1)
+
+def encodefuncs(steps, alters, quals, ks=CMAJOR):
+    '''
+    Return the array of Func of chords in keys, given arrays of the diatonic steps and alterations of their roots, of
+    the indices of their qualities in QUALITIES and of the indices of the keys, as for encodetones. Func is -1 where
+    the root has no tone in the key, for which Func raises ValueError.
+    '''
+    tones = encodetones(steps, alters, ks)
+    return np.where(tones >= 0, tones * 4 + np.asarray(quals) % 4, -1)
+
+def decodetones(tones, ks=CMAJOR):
+    '''
+    Return the arrays of the diatonic steps (in the octave of C4) and alterations of the pitches of Pitch for an array
+    of tones in keys, given as for encodetones, with step -1 for tones out of range.
+    '''
+    tones = np.asarray(tones)
+    tsteps, _, talters = scaletables()
+    valid = (tones >= 0) & (tones < T)
+    num, acc = tones // 7 % 7, tones % 7
+    return np.where(valid, 29 + (tsteps[ks, num] - 1) % 7, -1), np.where(valid, talters[ks, num] + acc - 3, 0.0)
+
+def decodefuncs(funcs, ks=CMAJOR):
+    '''
+    Return the arrays of the diatonic steps and alterations of the roots and the indices in QUALITIES of the qualities
+    of an array of functions of chords in keys, given as for encodetones, with step -1 for negative functions.
+    '''
+    funcs = np.asarray(funcs)
+    steps, alters = decodetones(np.where(funcs >= 0, funcs // 4, -1), ks)
+    return steps, alters, np.where(funcs >= 0, funcs % 4, 0)
+
 def transpose_tone(hist, key, tofunc=True):
     'Transpose histogram of absolute tones to tones in a given key.'
     if tofunc:
-        arr = abs2func_tone[keys.index(key)]
+        arr = tonetables()[0][keys.index(key)]
     else:
-        arr = func2abs_tone[keys.index(key)]
+        arr = tonetables()[1][keys.index(key)]
     return hist[arr]*(arr!=-1)
 
 # matrices converting absolute notes/chords to functions in a key
@@ -66,73 +161,179 @@ C = F
 def Key(key):
     return keys.index(key)
 
+def Mode(key):
+    return int(key.mode == 'major')
+
+STATS = ['cs', 'ts', 'ns', 'es', 'vs', 'ks'] # arrays of Stats
+
+def matrix(s):
+    'Convert a score into a TxN matrix of note durations in each time slice + Tx1 array of the midpoints of the slices.'
+    rows = list(matrixrows(s))
+    if not rows:
+        return np.zeros((0,T)), np.zeros(0)
+    m, ts = zip(*rows)
+    return np.array(m), np.array(ts, float)
+
+def matrixrows(s):
+    '''
+    Iterate through the rows of matrix(s) along with the midpoints of their slices, holding one row at a time.
+    The slices end at the end times of the notes and rests of the score. The notes are swept once in order of offset,
+    each adding the duration of the slice it begins in to the entries of its tones in that slice.
+    '''
+    s = s.flat.notesAndRests.stream()
+    endtimes = s._uniqueOffsetsAndEndTimes(endTimesOnly=True)
+    i, t0, row = 0, 0, np.zeros(T)
+    for n in s: # sorted by offset
+        while i < len(endtimes) and endtimes[i] <= n.offset:
+            yield row, (t0 + endtimes[i])/2
+            i, t0, row = i + 1, endtimes[i], np.zeros(T)
+        if i == len(endtimes):
+            break
+        if isinstance(n, chord.Chord):
+            for p in n.pitches:
+                row[Tone(p)] += endtimes[i] - t0
+        elif isinstance(n, note.Note):
+            row[Tone(n.pitch)] += endtimes[i] - t0
+    for t in endtimes[i:]:
+        yield row, (t0 + t)/2
+        t0, row = t, np.zeros(T)
+
+class NoteMatrix:
+    '''
+    Sparse TxN note matrix in compressed sparse row form, as returned by get_matrix for sparse samples. The nonzero
+    entries of row t are at the tones[offsets[t]:offsets[t+1]] columns, with the same durations. Sums and products
+    are computed from the nonzero entries, as for the dense matrices.
+    '''
+    def __init__(self, offsets, tones, durations):
+        self.offsets, self.tones, self.durations = offsets, tones, durations
+        self.shape = len(offsets) - 1, N
+    
+    @classmethod
+    def fromdense(cls, m):
+        'Return the sparse form of a dense note matrix.'
+        rows, tones = m.nonzero() # in row major order
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(m)))]).astype(np.int32)
+        return cls(offsets, tones.astype(np.int8), m[rows, tones])
+    
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.tones.nbytes + self.durations.nbytes
+    
+    def rows(self):
+        'Return the row of each nonzero entry.'
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.offsets))
+    
+    def toarray(self):
+        'Return the dense form of the matrix.'
+        m = np.zeros(self.shape)
+        m[self.rows(), self.tones] = self.durations
+        return m
+    
+    def sum(self, axis=None):
+        'Return the sum of the entries of the matrix, or along an axis, as for dense arrays.'
+        if axis is None:
+            return self.durations.sum()
+        if axis == 0:
+            return np.bincount(self.tones, self.durations, N)
+        return np.bincount(self.rows(), self.durations, self.shape[0])
+    
+    def dot(self, a):
+        'Return the product of the matrix and an N or NxK array.'
+        products = self.durations.reshape((-1,) + (1,) * (a.ndim - 1)) * a[self.tones]
+        result = np.zeros((self.shape[0],) + a.shape[1:])
+        nonempty = self.offsets[:-1] < self.offsets[1:] # as reduceat sums empty rows to the next entry
+        if nonempty.any():
+            result[nonempty] = np.add.reduceat(products, self.offsets[:-1][nonempty], axis=0)
+        return result
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    def __iter__(self):
+        'Iterates through the tones and durations of the nonzero entries of each row.'
+        for t in xrange(self.shape[0]):
+            yield self.tones[self.offsets[t]:self.offsets[t+1]], self.durations[self.offsets[t]:self.offsets[t+1]]
+
+def rows(m):
+    'Iterate through the tones and durations of the nonzero entries of each row of a dense or sparse note matrix.'
+    if isinstance(m, NoteMatrix):
+        return iter(m)
+    return ((r.nonzero()[0], r[r.nonzero()[0]]) for r in m)
+
+def masks(m):
+    'Return the T array of the 49-bit masks of the tones of each time slice of a dense or sparse note matrix.'
+    if isinstance(m, NoteMatrix): # the tones of each row are distinct, so their powers of 2 sum exactly to the mask
+        return np.bincount(m.rows(), 2.0 ** m.tones, len(m)).astype(np.int64)
+    return (m != 0).dot(1 << np.arange(T, dtype=np.int64))
+
+chordfuncs = {} # Func of the chord of the tones of each mask in each key, see chordfunc
+
+def chordfunc(mask):
+    '''
+    Return the K array of the Func in each key of the chord of the tones in a 49-bit mask, recognizing its root and
+    quality with music21 once for each mask, with -1 where the root has no tone in the key.
+    '''
+    if mask not in chordfuncs:
+        c = chord.Chord([Pitch(t) for t in xrange(T) if mask >> t & 1])
+        qual = ['major','minor','diminished','augmented', 'other'].index(c.quality) % 4
+        roots = tonetables()[1][:, Tone(c.root())] # Func(c, k) is the tone of the root in k followed by the quality
+        chordfuncs[mask] = np.where(roots >= 0, roots * 4 + qual, -1)
+    return chordfuncs[mask]
+
 class Sample:
     '''
     A processed sample chorale containing a list of chords, with optionally specified harmonic velocity.
+    Samples are loaded from the parse cache, parsing the file only if it is not cached.
     '''
-    def __init__(self, filename, fromCorpus=False):
+    def __init__(self, filename, fromCorpus=False, sparse=False):
         self.filename = filename
-        if fromCorpus:
-            self.s = corpus.parse(filename)
-        else:
-            self.s = converter.parse(filename)
-        # self.cs = self.s.flat.notesAndRests.stream().chordify()
+        self.path = corpus.getWork(filename) if fromCorpus else filename
+        self.data = cache.sample(self.path)
         
-        self.key = self.s.analyze('krumhansl')
+        self.key = self.data.key('krumhansl')
         self.vel = None # TODO change this, perhaps use qualities other than vel, such as measure ends
         self.matrix = None
+        if sparse: # keep only the sparse form of the matrix
+            self.matrix, self.ts = NoteMatrix.fromdense(self.data.matrix), self.data.ts
+            self.data.matrix = self.data.arrays['matrix'] = None
+    
+    def score(self):
+        'Parse and return the music21 score of the sample.'
+        return converter.parse(self.path)
         
-    # function converting sample into TxN matrix of notes + Tx1 array of absolute durations
+    # function converting sample into TxN matrix of notes (a NoteMatrix for sparse samples) + Tx1 array of absolute durations
     def get_matrix(self):
         if self.matrix is None:
-            s = self.s.flat.notesAndRests.stream()
-            endtimes = s._uniqueOffsetsAndEndTimes(endTimesOnly=True)
-            l = len(endtimes)
-            self.matrix = np.zeros((l,T))
-            self.ts = np.zeros(l)
-            t0 = 0
-            for i, t in enumerate(endtimes):
-                a = s.getElementsByOffset(t0, t, includeEndBoundary=False)
-                for n in a:
-                    if isinstance(n, chord.Chord):
-                        for p in n.pitches:
-                            self.matrix[i, Tone(p)] += t - t0
-                    elif isinstance(n, note.Note):
-                        self.matrix[i, Tone(n.pitch)] += t - t0
-                self.ts[i] = (t0 + t)/2
-                t0 = t
+            self.matrix, self.ts = self.data.matrix, self.data.ts
         return self.matrix, self.ts
     
     def measures(self):
-        'Iterates through each measure of sample.'
-        for m in self.cs:
+        'Iterates through each measure of sample, parsing and chordifying it.'
+        for m in self.score().chordify():
             if isinstance(m, stream.Measure):
                 yield m
     
     def chords(self):
         'Iterates through each chord of sample.'
-        for m in self.measures():
-            for c in m.notes: # cannot call notes directly apparently
-                yield c
+        return self.data.chords()
     
     def notes(self, voice):
-        'Iterates through each note in sample at a given voice.'
-        for p in self.s.parts[voice]:
-            for m in p.getElementsByClass('Measure'):
-                for n in m.notes:
-                    yield n
+        'Iterates through the pitch of each note in sample at a given voice.'
+        return iter(self.data.notes(voice)[2])
     
     # iterable overrides, may be made more efficient
     def __iter__(self):
         return self.chords()
     def __len__(self):
-        return len(self.cs)
+        return sum(1 for _ in self.chords())
     def __getitem__(self, key):
         return list(self.chords())[key] # can also take slice objects
     
     def __hash__(self):
         return hash(self.filename)
     def __eq__(self, other):
+        if isinstance(other, basestring): # samples are identified by filename, e.g. in loaded models
+            return self.filename == other
         return isinstance(other, Sample) and self.filename == other.filename
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -156,26 +357,24 @@ class Stats:
         
         if sample is not None:
             # construct stats from sample matrix
-            self.ks[Key(sample.key)] += 1
+            k, mode = Key(sample.key), Mode(sample.key)
+            self.ks[k] += 1
             # construct note histogram
             m = sample.get_matrix()[0]
             self.ns += transpose_tone(m.sum(axis=0), sample.key) # remove later
             # TODO handle the rest of the arrays
+            tones = tonetables()[1][k] # tones in the key of each absolute tone
             c1 = None
-            for t in xrange(m.shape[0]):
+            for mask, (ns, durations) in itertools.izip(masks(m), rows(m)):
                 # infer which chord is active
-                notes = [Pitch(n) for n in m[t].nonzero()[0]]
-                if len(notes) == 0:
+                if not mask:
                     continue
-                c = chord.Chord(notes)
-                # if t % 50 == 0:
-                #     print c, m[t].sum(), Func(c, sample.key), Chord(Func(c, sample.key), sample.key)
+                c = chordfunc(mask)[k]
                 if c1 is None:
-                    self.cs[int(sample.key.mode == 'major'), Func(c,sample.key)] += m[t].sum()
+                    self.cs[mode, c] += durations.sum()
                 else: # may distribute 'other' chords to every other mode
-                    self.ts[int(sample.key.mode == 'major'), Func(c1,sample.key), Func(c,sample.key)] += m[t].sum() 
-                for n in notes:
-                    self.es[int(sample.key.mode == 'major'), Tone(n,sample.key), Func(c,sample.key)] += m[t,Tone(n)]
+                    self.ts[mode, c1, c] += durations.sum()
+                np.add.at(self.es, (mode, tones[ns], c), durations)
                 c1 = c
    
     def __add__(self, other):
@@ -190,25 +389,97 @@ class Stats:
     
     def __radd__(self, other):
         return other.__add__(self)
+
+    def __sub__(self, other):
+        res = Stats()
+        res.cs = self.cs - other.cs
+        res.ts = self.ts - other.ts
+        res.ns = self.ns - other.ns
+        res.vs = self.vs - other.vs
+        res.es = self.es - other.es
+        res.ks = self.ks - other.ks
+        return res
     
     # add methods returning NxK etc. probability matrices looking up entries for Tone(n,k) etc.
 
+def samplestats(filename):
+    'Return a filename along with the Stats of its sample, to be run in worker processes.'
+    return filename, Stats(Sample(filename))
+
+def boundedmap(pool, func, items, window):
+    '''
+    Apply func to each of items in a pool of worker processes, and iterate through the results in order. At most window
+    items are submitted but not yet yielded, counting finished results held behind a slow item, and the next item is
+    submitted as soon as a result is yielded, rather than once a whole batch has finished.
+    '''
+    items = list(items)
+    calls = []
+    for i in xrange(len(items)):
+        while len(calls) < len(items) and len(calls) - i < window:
+            calls.append(pool.apply_async(func, (items[len(calls)],)))
+        yield calls[i].get()
+        calls[i] = None
+
+def treesum(stats):
+    'Sum an iterable of Stats pairwise in a balanced binary tree, keeping only one partial sum per level in memory.'
+    stack = [] # pairs of levels and partial sums
+    for s in stats:
+        level = 0
+        while stack and stack[-1][0] == level:
+            s = stack.pop()[1] + s
+            level += 1
+        stack.append((level, s))
+    total = Stats()
+    while stack:
+        total = stack.pop()[1] + total
+    return total
+
+def unique(iterable):
+    'Iterate through the distinct elements of iterable in order.'
+    seen = set()
+    for x in iterable:
+        if x not in seen:
+            seen.add(x)
+            yield x
+
 class Env:
     '''
     Program environment containing probabilities for each chord, note and transition, acquired from sample chord sequences.
     '''
     def __init__(self):
         self.stats = Stats()
-        self.samples = dict()
+        self.samples = dict() # Stats of each sample by filename, None if not loaded from a snapshot
+        self.hashes = dict()  # content hashes of samples, loaded from snapshots
+        self.stored = dict()  # positions of the Stats of samples in the arrays of the snapshot loaded from
+        self.arrays = dict()  # arrays of that snapshot, memory-mapped
+        self.generation = 0   # incremented whenever the Stats change, e.g. to invalidate cached tables
     
-    def train(self, filenames, verbose=False):
-        'Train probabilities from given iterator of filenames, for example corpus.getBachChorales().'
-        for f in filenames:
-            s = Sample(f)
-            if s not in self.samples:
+    def train(self, filenames, verbose=False, workers=1, chunksize=4):
+        '''
+        Train probabilities from given iterator of filenames, for example corpus.getBachChorales().
+        With workers > 1, samples are parsed and their Stats constructed in a pool of worker processes, with up to
+        chunksize samples per worker submitted ahead of those summed. The Stats are summed in a fixed order, so that
+        the result does not depend on the number of workers.
+        '''
+        filenames = [f for f in unique(filenames) if f not in self.samples]
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = boundedmap(pool, samplestats, filenames, workers * chunksize)
+        else:
+            results = itertools.imap(samplestats, filenames)
+        
+        def record():
+            for i, (f, stats) in enumerate(results):
                 if verbose:
-                    print 'Processing %s...' % f
-                self.process(s)
+                    print 'Processed %s (%d/%d)' % (f, i + 1, len(filenames))
+                self.samples[f] = stats
+                yield stats
+        try:
+            self.stats += treesum(record())
+            self.generation += 1
+        finally:
+            if workers > 1:
+                pool.terminate()
     
     def process(self, sample):
         'Update probabilities based on a sample sequence of chords.'
@@ -217,38 +488,159 @@ class Env:
         
         # construct Stats from Sample
         # may also look at small windows in sample
-        self.samples[sample] = Stats(sample)
-        self.stats += self.samples[sample]
+        self.samples[sample.filename] = Stats(sample)
+        self.stats += self.samples[sample.filename]
+        self.generation += 1
+    
+    def save(self, path):
+        '''
+        Save the environment as a snapshot in directory path, to be loaded by Env.load.
+        The Stats of each sample are stored as the nonzero entries of their arrays, copied from the snapshot the
+        environment was loaded from if not loaded, along with the log probability tensors of histarray.tensors.
+        '''
+        arrays = dict(('stats.' + a, getattr(self.stats, a)) for a in STATS)
+        names = sorted(f for f in self.samples if self.samples[f] is not None or f in self.stored)
+        for a in STATS:
+            entries = [self.entries(f, a) for f in names]
+            arrays['samples.%s.index' % a] = np.concatenate([np.zeros(0, int)] + [i for i, _ in entries])
+            arrays['samples.%s.value' % a] = np.concatenate([np.zeros(0)] + [x for _, x in entries])
+            arrays['samples.%s.offset' % a] = np.cumsum([0] + [len(i) for i, _ in entries])
+        import histarray # imported here, as histarray depends on this module
+        arrays.update(('tensors.' + name, t) for name, t in histarray.tensors(self).iteritems())
+        snapshot.save(path, 'freqsarray', arrays, dict((f, self.hashes.get(f)) for f in self.samples), stats = names)
+    
+    @classmethod
+    def load(cls, path, samples = False, validate = False):
+        '''
+        Load an environment saved by Env.save from directory path, memory-mapping its Stats, optionally loading the
+        Stats of each sample and checking that the files of its samples have not changed since. Otherwise the Stats of
+        a sample are constructed from the snapshot when needed, e.g. to remove it or to save the environment again.
+        The environment can be trained further on new samples.
+        '''
+        manifest, arrays = snapshot.load(path, 'freqsarray')
+        if validate:
+            changed = snapshot.validate(manifest)
+            if changed:
+                raise ValueError('samples changed since snapshot %s was saved: %s' % (path, ', '.join(changed)))
+        env = cls()
+        for a in STATS:
+            setattr(env.stats, a, arrays['stats.' + a])
+        env.hashes = snapshot.samples(manifest)
+        env.samples = dict.fromkeys(env.hashes)
+        env.stored = dict((f, j) for j, f in enumerate(manifest['stats']))
+        env.arrays = arrays
+        import histarray
+        if all('tensors.' + name in arrays for name in histarray.TENSORS): # not saved by older versions
+            histarray.settensors(env, dict((name, arrays['tensors.' + name]) for name in histarray.TENSORS))
+        if samples:
+            for f in env.stored:
+                env.samples[f] = env.statsof(f)[1]
+        return env
+    
+    def entries(self, f, a):
+        'Return the indices and values of the nonzero entries of Stats array a of sample f, flattened.'
+        if self.samples[f] is not None:
+            x = getattr(self.samples[f], a).ravel()
+            i = x.nonzero()[0]
+            return i, x[i]
+        j = self.stored[f]
+        o = self.arrays['samples.%s.offset' % a][j:j+2]
+        return self.arrays['samples.%s.index' % a][o[0]:o[1]], self.arrays['samples.%s.value' % a][o[0]:o[1]]
     
-    # TODO fill these below, or move some to Stats
+    def statsof(self, sample):
+        '''
+        Return the filename of a sample or filename the environment was trained on, along with its Stats, constructed
+        from the snapshot the environment was loaded from if not loaded.
+        Raises ValueError if the environment was not trained on the sample or its Stats are not available.
+        '''
+        f = getattr(sample, 'filename', sample)
+        if f not in self.samples:
+            raise ValueError('environment not trained on %s' % f)
+        if self.samples[f] is not None:
+            return f, self.samples[f]
+        if f not in self.stored:
+            raise ValueError('Stats of %s not saved in the snapshot the environment was loaded from' % f)
+        stats = Stats()
+        for a in STATS:
+            i, x = self.entries(f, a)
+            getattr(stats, a).flat[i] = x
+        return f, stats
     
-    def kprob(self, k):
-        'kprob(k) -> Return probability of key k.'
-        return (self.stats.ks[k]+1) / (self.stats.ks+1).sum()
+    def remove(self, sample):
+        'Untrain the environment on a sample or filename by subtracting its Stats.'
+        f, stats = self.statsof(sample)
+        self.stats = self.stats - stats
+        self.generation += 1
+        del self.samples[f]
+        self.hashes.pop(f, None)
     
-    def cprob(self, c, k):
-        'cprob(c, k) -> Return probability of chord c occurring in key k.'
-        return self.cfreq[True, Func(c, k)]
+    def without(self, samples):
+        '''
+        Return an environment trained on the samples of this one except the given samples or filenames, subtracting
+        their Stats from the total instead of counting the remaining samples again. The Stats of samples are shared.
+        '''
+        removed = dict(self.statsof(s) for s in samples)
+        env = Env()
+        env.stats = self.stats - treesum(removed[f] for f in sorted(removed))
+        env.samples = dict((f, s) for f, s in self.samples.iteritems() if f not in removed)
+        env.hashes = dict((f, h) for f, h in self.hashes.iteritems() if f not in removed)
+        env.stored, env.arrays = self.stored, self.arrays
+        return env
     
-    def nprob(self, n, c, k, v = None):
-        'nprob(n, c, k[, v]) -> Return probability of note n occurring in voice v of chord c in key k.'
-        return self.nfreq[True, Tone(n, k), k.mode, Func(c, k), v] # should normalize over v if not none
+    def folds(self, k, samples = None):
+        '''
+        Partition samples, by default every sample of the environment, into k consecutive folds (plus one for the
+        remainder), yielding each fold along with the environment trained on the other samples, as given by without.
+        '''
+        samples = list(self.samples) if samples is None else list(samples)
+        n = max(len(samples) / k, 1)
+        for i in xrange(0, len(samples), n):
+            fold = samples[i:i+n]
+            yield fold, self.without(fold)
     
-    def tprob(self, c1, c, k, vel = None):
-        'tprob(c1, c, k[, vel]) -> Return probability of chord c changing to chord c1 in key k under harmonic velocity vel.'
+    # probabilities are returned as LogProbs if log is True, computed from the logarithms of the counts
+    
+    def kprob(self, k, log = False):
+        'kprob(k[, log]) -> Return probability of key k.'
+        return prob(self.stats.ks[Key(k)]+1, (self.stats.ks+1).sum(), log)
+    
+    def cprob(self, c, k, log = False):
+        'cprob(c, k[, log]) -> Return probability of chord c occurring in key k.'
+        m = Mode(k)
+        cs = self.stats.cs[m] + self.stats.ts[m].sum(axis=0) # initial chords and chords following a transition
+        return prob(cs[Func(c, k)]+1, (cs+1).sum(), log)
+    
+    def nprob(self, n, c, k, v = None, log = False):
+        'nprob(n, c, k[, v, log]) -> Return probability of note n occurring in chord c in key k. Voices are not counted yet.'
+        es = self.stats.es[Mode(k), :, Func(c, k)]
+        return prob(es[Tone(n, k)]+1, (es+1).sum(), log)
+    
+    def tprob(self, c1, c, k, vel = None, log = False):
+        'tprob(c1, c, k[, vel, log]) -> Return probability of chord c changing to chord c1 in key k under harmonic velocity vel.'
         if c == c1:
-            return self.cprob(c, k) # perhaps dependent on vel
-        f, f1 = Func(c, k), Func(c1, k)
-        return self.tfreq[True, f1, f, s]
+            return self.cprob(c, k, log) # perhaps dependent on vel
+        ts = self.stats.ts[Mode(k), Func(c, k)]
+        return prob(ts[Func(c1, k)]+1, (ts+1).sum(), log)
     
-    def vprob(self, n1, n, c1, c, k, v = None, vel = None):
-        '''vprob(n1, n, c1, c, k[, v, vel]) -> 
+    def vprob(self, n1, n, c1, c, k, v = None, vel = None, log = False):
+        '''vprob(n1, n, c1, c, k[, v, vel, log]) -> 
         Return probability of note n in chord c changing to note n1 in chord c1 
         in key k and voice v under harmonic velocity vel.'''
         if n == n1 and c == c1:
-            return self.nprob(n, c, k, v) # perhaps dependent on vel
-        f, f1 = Func(c, k), Func(c1, k)
-        t, t1 = Tone(n, k), Tone(n1, k)
-        return self.vfreq[True, t1, t, f1, f, v, s]
-    
-table = Env()
\ No newline at end of file
+            return self.nprob(n, c, k, v, log) # perhaps dependent on vel
+        vs = self.stats.vs[Tone(n, k)] # TODO count in Stats, conditioned on chords
+        return prob(vs[Tone(n1, k)]+1, (vs+1).sum(), log)
+
+def prob(count, total, log = False):
+    'Return the probability count / total, as a LogProb if log is True.'
+    if log:
+        return frequtils.LogProb(count, total)
+    return count / total
+
+def gettable():
+    'Return the shared environment, loading its snapshot or training it on the Bach chorales on first use.'
+    return snapshot.model('freqsarray', Env, corpus.getBachChorales)
+
+def settable(table):
+    'Replace the shared environment, e.g. by one loaded from a snapshot of a subset of samples.'
+    snapshot.models['freqsarray'] = table
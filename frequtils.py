@@ -1,9 +1,21 @@
 from music21 import *
 from fractions import Fraction
+import math
+import cache
 
 tones = [n + a for n in 'CDEFGABcdefgab' for a in ['-', '#', '']]
 keys = map(key.Key, tones)
 chords = [chord.Chord(map(k.pitches.__getitem__, [0, 2, 4])) for k in keys]
+qualities = dict((id(c), c.quality) for c in chords) # of chords by id, as music21 computes them on every access
+
+scales = {} # pitches of the scale of each key, by tonic and mode, see scale
+
+def scale(key):
+    'Return the pitches of the scale of a key, computed once for each key, as music21 realizes them on every access.'
+    index = key.tonic.name, key.mode
+    if index not in scales:
+        scales[index] = key.pitches
+    return scales[index]
 
 class Func(tuple):
     '''
@@ -12,9 +24,9 @@ class Func(tuple):
     def __new__(cls, chord, key):
         try:
             num = (chord.root().diatonicNoteNum - key.tonic.diatonicNoteNum) % 7
-            acc = (chord.root().ps - key.pitches[num].ps) % 12
+            acc = (chord.root().ps - scale(key)[num].ps) % 12
             
-            return tuple.__new__(cls, (num, acc, chord.quality, key.mode))
+            return tuple.__new__(cls, (num, acc, qualities.get(id(chord)) or chord.quality, key.mode))
         except AttributeError:
             return ()
     pass
@@ -34,27 +46,28 @@ class Tone(tuple):
 class Sample:
     '''
     A processed sample chorale containing a list of chords, with optionally specified harmonic velocity.
+    Samples are loaded from the parse cache, parsing the file only if it is not cached.
     '''
     def __init__(self, filename):
         self.filename = filename
-        self.s = converter.parse(filename)
-        self.cs = self.s.chordify()
-        ks = self.cs.getKeySignatures()[0]
+        self.data = cache.sample(filename)
         
-        self.key = key.Key(ks.getScale().tonic, ks.mode)
+        self.key = self.data.key('signature')
         self.vel = None # TODO change this, perhaps use qualities other than vel, such as measure ends
+    
+    def score(self):
+        'Parse and return the music21 score of the sample.'
+        return converter.parse(self.filename)
         
     def measures(self):
-        'Iterates through each measure of sample.'
-        for m in self.cs:
+        'Iterates through each measure of sample, parsing and chordifying it.'
+        for m in self.score().chordify():
             if isinstance(m, stream.Measure):
                 yield m
     
     def chords(self):
         'Iterates through each chord of sample.'
-        for m in self.measures():
-            for c in m.notes: # cannot call notes directly apparently
-                yield c
+        return self.data.chords()
     
     def notes(self, voice):
         'Iterates through each note in sample at a given voice.'
@@ -65,13 +78,15 @@ class Sample:
     def __iter__(self):
         return self.chords()
     def __len__(self):
-        return len(self.cs)
+        return sum(1 for _ in self.chords())
     def __getitem__(self, key):
         return list(self.chords())[key] # can also take slice objects
     
     def __hash__(self):
         return hash(self.filename)
     def __eq__(self, other):
+        if isinstance(other, basestring): # samples are identified by filename, e.g. in loaded models
+            return self.filename == other
         return isinstance(other, Sample) and self.filename == other.filename
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -106,3 +121,70 @@ class Prob(Fraction):
         return Prob(Fraction.__div__(self, other) if other != 0 else 0)
     def __rdiv__(self, other):
         return Prob(other) / self
+
+class LogProb(float):
+    '''
+    Probability stored as its natural logarithm, so that products of many probabilities are sums of floats.
+    Constructed like Prob, e.g. LogProb(1, 288), and combined and compared with other probabilities as probabilities.
+    '''
+    def __new__(cls, val = 0, norm = None):
+        if norm is None:
+            return float.__new__(cls, ln(val))
+        return float.__new__(cls, ln(val) - ln(norm) if norm else float('-inf'))
+    
+    @classmethod
+    def fromlog(cls, log):
+        'Return the probability with the given natural logarithm.'
+        return float.__new__(cls, log)
+    
+    def prob(self):
+        'Return the probability as a float.'
+        return math.exp(self)
+    
+    def __repr__(self):
+        return 'exp(%r)' % float(self)
+    __str__ = __repr__
+    
+    # products and quotients of probabilities are sums and differences of logarithms
+    def __mul__(self, other):
+        return LogProb.fromlog(float(self) + ln(other))
+    def __rmul__(self, other):
+        return LogProb.fromlog(ln(other) + float(self))
+    def __div__(self, other): # modified for 0 as in Prob
+        other = ln(other)
+        return LogProb.fromlog(float(self) - other if other != float('-inf') else other)
+    def __rdiv__(self, other):
+        return LogProb(other) / self
+    __truediv__, __rtruediv__ = __div__, __rdiv__
+    def __add__(self, other):
+        a, b = sorted([float(self), ln(other)])
+        return LogProb.fromlog(b + math.log1p(math.exp(a - b)) if a != float('-inf') else b)
+    __radd__ = __add__
+    
+    # compare other probabilities as probabilities
+    def __lt__(self, other):
+        return float(self) < ln(other)
+    def __le__(self, other):
+        return float(self) <= ln(other)
+    def __gt__(self, other):
+        return float(self) > ln(other)
+    def __ge__(self, other):
+        return float(self) >= ln(other)
+    def __eq__(self, other):
+        return float(self) == ln(other)
+    def __ne__(self, other):
+        return float(self) != ln(other)
+    __hash__ = float.__hash__
+
+def ln(x):
+    '''
+    Return the natural logarithm of a probability, -inf for 0, computed exactly for fractions of large integers.
+    LogProbs are returned as the logarithms they store.
+    '''
+    if isinstance(x, LogProb):
+        return float(x)
+    if x == 0:
+        return float('-inf')
+    if isinstance(x, Fraction):
+        return math.log(x.numerator) - math.log(x.denominator)
+    return math.log(x)
@@ -1,38 +1,69 @@
 import freqs
 import heapq as hp
-from collections import defaultdict
+from collections import defaultdict, deque
 from music21 import corpus
 from frequtils import *
+import frequtils
+import freqsarray
+import histarray
+import numpy as np
+import weakref
 
-table = freqs.table
 threshold = Prob(1, 288)
 
-def harmonize(notes, key = None, voice = None, vel = None): # TODO generalize as kwargs
+# generation and log probability tables of each environment, by key and voice, see cache, dropped with the environment
+logtables = weakref.WeakKeyDictionary()
+
+def harmonize(notes, key = None, voice = None, vel = None, exact = False, beam = None, margin = None):
     '''
-    harmonize(notes, key = None, voice = None, vel = None)
+    harmonize(notes, key = None, voice = None, vel = None, exact = False, beam = None, margin = None)
     Returns the most probable sequence of chords for the given sequence of notes, with optional information
     given for the key, voice, signature and harmonic rhythm.
     The key is inferred if not provided; the other variables are averaged or not considered.
+    Probabilities are multiplied as LogProbs, or as exact Probs if exact is True, e.g. for debugging.
+    If beam or margin is given, only the beam likeliest (key, chord) states are kept after each note, along with
+    those whose log probability is within margin of the likeliest, trading accuracy for speed.
+    '''
+    tones = [freqsarray.Tone(n) for n in notes]
+    if exact or vel is not None or -1 in tones: # not covered by the precomputed tables
+        return viterbi(notes, key, voice, vel, exact, beam, margin)
+    return viterbi_array(tones, key, voice, beam, margin)
+
+def viterbi(notes, key = None, voice = None, vel = None, exact = False, beam = None, margin = None):
     '''
+    viterbi(notes, key = None, voice = None, vel = None, exact = False, beam = None, margin = None)
+    Run the Viterbi algorithm for harmonize one state at a time, looking up each probability in the environment.
+    '''
+    log = not exact
     
     # Viterbi algorithm
-    probs  = defaultdict(Prob)
+    probs  = defaultdict(Prob if exact else LogProb)
     preds  = {}
     length = len(notes)
     
-    for c, k, p in chords(notes[0], key, voice): # should iterate through all keys if key None, else just k
+    best, bestprob = None, probs.default_factory()
+    states = [] # states kept after the previous note, in the order of chords
+    for c, k, p in chords(notes[0], key, voice, log): # should iterate through all keys if key None, else just k
         probs[c, k, 0] = p # cprob(c, k) * nprob(notes[0], c, k, voice) # perhaps move cprob to chords
+        states.append((c, k))
+        if bestprob < p:
+            best, bestprob = (c, k), p
     
     for i in xrange(1, length):
-        bestprob = Prob()
+        prev = defaultdict(list) # chords of the states kept after the previous note, by key
+        for c1, k in beamstates(states, [probs[c1, k, i - 1] for c1, k in states], beam, margin):
+            prev[k].append(c1)
+        bestprob = probs.default_factory()
         best = None
-        for c, k, _ in chords(notes[i], key, voice):
+        states = []
+        for c, k, _ in chords(notes[i], key, voice, log):
             # find max and arg max of transition
-            for c1, _ in chords(notes[i-1], k):
-                newprob = probs[c1, k, i - 1] * cprob(c1, k, c, vel) * nprob(notes[i], c1, k, voice, notes[i-1], c, vel)
+            for c1 in prev[k]:
+                newprob = probs[c1, k, i - 1] * cprob(c, k, c1, vel, log) * nprob(notes[i], c, k, voice, notes[i-1], c1, vel, log)
                 if probs[c, k, i] < newprob:
                     probs[c, k, i] = newprob
                     preds[c, k, i] = c1
+            states.append((c, k))
             # update bestprob and bestchor
             if bestprob < probs[c, k, i]:
                 bestprob = probs[c, k, i]
@@ -49,47 +80,286 @@ def harmonize(notes, key = None, voice = None, vel = None): # TODO generalize as
     
     return k, chors, bestprob
 
-def cprob(c, k, c1 = None, vel = None):
+def beamstates(states, probs, beam = None, margin = None):
+    '''
+    beamstates(states, probs[, beam, margin])
+    Returns the states, in order, whose probabilities are among the beam greatest, breaking ties by order, and
+    whose log probabilities are within margin of the greatest. Every state is kept if beam and margin are None.
+    '''
+    if beam is None and margin is None:
+        return states
+    logs = map(ln, probs)
+    keep = sorted(xrange(len(states)), key = lambda j: -logs[j])[:beam] # stable, so ties are broken by order
+    if margin is not None:
+        keep = [j for j in keep if logs[j] >= max(logs) - margin]
+    keep = set(keep)
+    return [s for j, s in enumerate(states) if j in keep]
+
+def beamarray(probs, beam = None, margin = None):
+    '''
+    beamarray(probs[, beam, margin])
+    Set the entries of each row of an array of log probabilities outside the beam greatest, breaking ties by order,
+    or not within margin of the greatest to -inf in place, as beamstates does.
+    '''
+    flat = probs.reshape(len(probs), -1)
+    if beam is not None and beam < flat.shape[1]:
+        order = np.argsort(-flat, axis = 1, kind = 'mergesort') # stable, so ties are broken by order
+        flat[np.arange(len(flat))[:, None], order[:, beam:]] = -np.inf
+    if margin is not None:
+        flat[flat < flat.max(axis = 1)[:, None] - margin] = -np.inf
+
+def viterbi_array(tones, key = None, voice = None, beam = None, margin = None):
+    '''
+    viterbi_array(tones, key = None, voice = None, beam = None, margin = None)
+    Run the Viterbi algorithm for harmonize on the absolute tones of a melody, as given by freqsarray.Tone,
+    updating the log probabilities of every (key, chord) state at once from the arrays returned by tables.
+    '''
+    return viterbi_batch([tones], key, voice, beam, margin)[0]
+
+def viterbi_batch(melodies, key = None, voice = None, beam = None, margin = None):
+    '''
+    viterbi_batch(melodies, key = None, voice = None, beam = None, margin = None)
+    Run viterbi_array on a list of melodies given as absolute tones, all in the same key and voice, at once.
+    Melodies are padded to the same length, and the probabilities of each are taken at its last note.
+    With a beam or margin, transitions are only computed in keys with states kept in some melody.
+    '''
+    ks = [key] if key else frequtils.keys
+    lk, lc, lt, le = map(np.array, zip(*[tables(k, voice) for k in ks])) # K, KxC, KxCxC, KxCxN
+    lengths = np.array(map(len, melodies))
+    tones = np.zeros((len(melodies), lengths.max()), int)
+    for b, t in enumerate(melodies):
+        tones[b, :len(t)] = t
+    emis = le[:, :, tones].transpose(2, 3, 0, 1) # BxLxKxC
+    pruning = beam is not None or margin is not None
+    
+    probs = (lc + emis[:, 0]) + lk[:, None]
+    final = probs.copy() # probabilities at the last note of each melody
+    preds = np.zeros((tones.shape[1],) + probs.shape, int)
+    for i in xrange(1, tones.shape[1]):
+        if pruning:
+            beamarray(probs, beam, margin)
+            active = np.isfinite(probs).any(axis = 2).any(axis = 0) # keys with states kept
+        else:
+            active = slice(None)
+        newprobs = probs[:, active, :, None] + lt[active] # BxKxC1xC
+        preds[i][:, active] = newprobs.argmax(axis=2)
+        probs = np.full(probs.shape, -np.inf) if pruning else probs
+        probs[:, active] = newprobs.max(axis=2) + emis[:, i][:, active]
+        final[lengths == i + 1] = probs[lengths == i + 1]
+    
+    # construct chords
+    results = []
+    for b, length in enumerate(lengths):
+        k, c = np.unravel_index(final[b].argmax(), final[b].shape)
+        bestprob = LogProb.fromlog(final[b, k, c])
+        cs = [c]
+        for i in xrange(length - 1, 0, -1):
+            c = preds[i, b, k, c]
+            cs.append(c)
+        cs.reverse()
+        results.append((ks[k], [frequtils.chords[c] for c in cs], bestprob))
+    return results
+
+def harmonize_batch(melodies, keys = None, voices = None, size = 64, beam = None, margin = None):
+    '''
+    harmonize_batch(melodies, keys = None, voices = None, size = 64, beam = None, margin = None)
+    Returns the result of harmonize for each of a list of melodies, optionally given lists of their keys and voices.
+    Melodies with the same key and voice are sorted by length and harmonized by viterbi_batch size at a time.
+    '''
+    keys = keys or [None] * len(melodies)
+    voices = voices or [None] * len(melodies)
+    results = [None] * len(melodies)
+    groups = defaultdict(list)
+    for i, (notes, k, v) in enumerate(zip(melodies, keys, voices)):
+        tones = [freqsarray.Tone(n) for n in notes]
+        if -1 in tones: # not covered by the precomputed tables
+            results[i] = viterbi(notes, k, v, beam = beam, margin = margin)
+        else:
+            groups[k and (k.tonic.name, k.mode), v].append((len(tones), i, tones))
+    for group in groups.itervalues():
+        group.sort()
+        for j in xrange(0, len(group), size):
+            batch = group[j:j+size]
+            first = batch[0][1]
+            harmonized = viterbi_batch([tones for _, _, tones in batch], keys[first], voices[first], beam, margin)
+            for (_, i, _), r in zip(batch, harmonized):
+                results[i] = r
+    return results
+
+class StreamingHarmonizer:
+    '''
+    Harmonizes notes as they are pushed one at a time, running the Viterbi algorithm of viterbi_array online.
+    The chord of each note is committed once lag further notes have been pushed, following the likeliest path at that
+    point, or earlier once every state kept agrees on it, in which case it equals the chord chosen by harmonize.
+    Only the back pointers of notes whose chords are not committed yet are stored, fewer than lag of them.
+    '''
+    def __init__(self, key = None, voice = None, lag = 8, beam = None, margin = None):
+        self.keys = [key] if key else frequtils.keys
+        self.voice, self.lag, self.beam, self.margin = voice, lag, beam, margin
+        self.lk, self.lc, self.lt, self.le = map(np.array, zip(*[tables(k, voice) for k in self.keys]))
+        self.reset()
+    
+    def reset(self):
+        'Start harmonizing a new melody.'
+        self.probs = None    # KxC log probabilities of the states at the last note
+        self.pending = 0     # number of notes whose chords are not committed
+        self.preds = deque() # KxC back pointers of each of these notes after the first
+        self.key = None      # key of the likeliest path when chords were last committed
+    
+    def push(self, note):
+        'Add the next note of the melody, returning the list of chords committed as a result.'
+        t = freqsarray.Tone(note)
+        if t == -1:
+            raise ValueError('note %s not covered by the precomputed tables' % note)
+        emis = self.le[:, :, t]
+        if self.probs is None:
+            self.probs = (self.lc + emis) + self.lk[:, None]
+        else:
+            beamarray(self.probs[None], self.beam, self.margin)
+            newprobs = self.probs[:, :, None] + self.lt # KxC1xC
+            self.preds.append(newprobs.argmax(axis=1))
+            self.probs = newprobs.max(axis=1) + emis
+        self.pending += 1
+        self.trim()
+        
+        # commit chords lag notes behind, and those on which the paths to every state kept converge
+        paths = self.paths(np.isfinite(self.probs))
+        converged = [len(set(p)) == 1 for p in paths] + [False]
+        return self.commit(max(self.pending - self.lag, converged.index(False)))
+    
+    def flush(self):
+        'Commit the chords of the remaining notes of the melody and start a new one, returning the list of chords.'
+        chords = self.commit(self.pending)
+        self.reset()
+        return chords
+    
+    def trim(self):
+        'Discard the back pointers of notes whose chords are committed.'
+        while len(self.preds) > max(self.pending - 1, 0):
+            self.preds.popleft()
+    
+    def paths(self, states):
+        '''
+        Return the flattened (key, chord) states at each note whose chord is not committed of the paths ending at a
+        KxC mask of states at the last note.
+        '''
+        ks, cs = states.nonzero()
+        paths = [ks * len(frequtils.chords) + cs]
+        for pred in reversed(self.preds):
+            cs = pred[ks, cs]
+            paths.append(ks * len(frequtils.chords) + cs)
+        paths.reverse()
+        return paths
+    
+    def commit(self, n):
+        'Commit the chords of the next n notes along the likeliest path, returning them.'
+        if n <= 0:
+            return []
+        best = np.zeros(self.probs.shape, bool)
+        best[np.unravel_index(self.probs.argmax(), self.probs.shape)] = True
+        path = [p[0] for p in self.paths(best)[:n]]
+        self.pending -= n
+        self.trim()
+        self.key = self.keys[path[0] / len(frequtils.chords)]
+        return [frequtils.chords[s % len(frequtils.chords)] for s in path]
+    
+    @property
+    def prob(self):
+        'The probability of the likeliest path so far, as a LogProb.'
+        return LogProb.fromlog(self.probs.max())
+
+def tables(k, voice = None):
+    '''
+    tables(k[, voice])
+    Returns the log probability tables of the shared environment in key k used by viterbi_array: ln p(k), the C array
+    of ln p(c|k), the CxC array of ln p(c|c1,k) and the CxN array of ln p(n|c,k) in the given voice for absolute tones n,
+    which is -inf for tones outside each chord or below the threshold, as chords does.
+    Computed once for each environment, key and voice, until the environment is trained further.
+    '''
+    table = freqs.gettable()
+    cached = cache(table)
+    index = k.tonic.name, k.mode, voice
+    if index not in cached:
+        le = histarray.logpnck(table, [k], voice)[0]
+        inchord = np.array([[p.pitchClass in c.pitchClasses for p in map(freqsarray.Pitch, xrange(freqsarray.N))]
+                            for c in frequtils.chords])
+        le[~inchord | (le <= ln(threshold))] = -np.inf
+        cached[index] = (histarray.logpk(table, [k])[0], histarray.logpck(table, [k])[0],
+                         histarray.logpcck(table, [k])[0], le)
+    return cached[index]
+
+def candidates(k, tone, voice = None):
     '''
-    cprob(c, k[, c1, vel])
-    Returns the probability that chord c will occur in key k, optionally after chord c1 and with harmonic velocity vel.
+    candidates(k, tone[, voice])
+    Returns the indices in frequtils.chords of the chords yielded by chords for a note with the given absolute tone in
+    key k, in order, along with their log probabilities, as slices of an index from tones to chords built from tables.
+    '''
+    cached = cache(freqs.gettable())
+    index = 'candidates', k.tonic.name, k.mode, voice
+    if index not in cached:
+        lk, lc, _, le = tables(k, voice)
+        valid = np.isfinite(le.T) # NxC
+        offsets = np.concatenate([[0], np.cumsum(valid.sum(axis=1))])
+        cached[index] = offsets, valid.nonzero()[1], ((lc + le.T) + lk)[valid] # chords in order for each tone
+    offsets, cs, scores = cached[index]
+    return cs[offsets[tone]:offsets[tone+1]], scores[offsets[tone]:offsets[tone+1]]
+
+def cache(table):
+    'Returns the dictionary of tables computed from an environment, emptied whenever the environment is trained.'
+    generation, cached = logtables.get(table, (None, None))
+    if generation != table.generation:
+        cached = {}
+        logtables[table] = table.generation, cached
+    return cached
+
+def cprob(c, k, c1 = None, vel = None, log = False):
+    '''
+    cprob(c, k[, c1, vel, log])
+    Returns the probability that chord c will occur in key k, optionally after chord c1 and with harmonic velocity vel,
+    as a LogProb if log is True.
     '''
     # compute P(Trans(Func(c, k), Func(c1, k))[| vel])
     # TODO normalize over None variables instead, or move that to freqs
-    if not c1 or not vel:
-        return table.cprob(c, k)
-    return table.tprob(c, k, c1, vel)
+    if c1 is None:
+        return freqs.gettable().cprob(c, k, log)
+    return freqs.gettable().tprob(c, c1, k, vel, log)
 
-def nprob(n, c, k, voice = None, n1 = None, c1 = None, vel = None):
+def nprob(n, c, k, voice = None, n1 = None, c1 = None, vel = None, log = False):
     '''
-    nprob(n, c, k[, voice, n1, c1, vel])
+    nprob(n, c, k[, voice, n1, c1, vel, log])
     Returns the probability that note n will occur in the given voice of chord c and key k, 
-    optionally after note n1 in chord c1 and with harmonic velocity vel.
+    optionally after note n1 in chord c1 and with harmonic velocity vel, as a LogProb if log is True.
     '''
     # compute P(Pitch(n, c) | Pitch(n1, c1), voice, Trans(Func(c1, k), Func(c, k)), vel)
     if not n1 or not c1 or not vel:
-        return table.nprob(n, c, k, voice)
-    return table.vprob(n, n1, c, c1, k, voice, vel)
+        return freqs.gettable().nprob(n, c, k, voice, log)
+    return freqs.gettable().vprob(n, n1, c, c1, k, voice, vel, log)
 
-def kprob(k):
+def kprob(k, log = False):
     '''
-    kprob(k)
-    Returns the marginal probability of a key.
+    kprob(k[, log])
+    Returns the marginal probability of a key, as a LogProb if log is True.
     '''
-    return table.kprob(k)
+    return freqs.gettable().kprob(k, log)
 
-def chords(note, key = None, voice = None):
+def chords(note, key = None, voice = None, log = False):
     '''
-    chords(note[, key, voice])
+    chords(note[, key, voice, log])
     Iterates through all chords that contain note, optionally in a given key or voice.
-    Returns a generator of tuples of type (Chord, Key, Probability).
+    Returns a generator of tuples of type (Chord, Key, Probability), with LogProbs if log is True.
     '''
     # probability = cprob(chord, key) * nprob(note, chord, key, voice)
-    def prob(c, n, k, v):
-        return cprob(c, k) * nprob(n, c, k, v) * kprob(k)
-    
-    for k in ([key] if key else keys):
-        for c in chords:
-            p = prob(c, note, key, voice)
+    tone = freqsarray.Tone(note)
+    if log and tone != -1: # look up the candidates in the index
+        for k in ([key] if key else frequtils.keys):
+            cs, scores = candidates(k, tone, voice)
+            for c, p in zip(cs, scores):
+                yield frequtils.chords[c], k, LogProb.fromlog(p)
+        return
+    for k in ([key] if key else frequtils.keys):
+        for c in frequtils.chords: # not shadowed by this function
+            if note.pitchClass not in c.pitchClasses:
+                continue
+            p = nprob(note, c, k, voice, log = log)
             if p > threshold: # TODO constant threshold
-                yield c, k, p
+                yield c, k, cprob(c, k, log = log) * p * kprob(k, log)
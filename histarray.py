@@ -3,49 +3,152 @@
 # TODO use arrays here
 
 import numpy as np
+import weakref
 
 import freqsarray as freqs 
 from math import *
 
 def findkey(table, s):
-    'Return the most likely key of a sample, given probability table.'
-    h = histogram(s)
-    return max((loglikelihood(table, h, k), k) for k in freqs.keys)
+    'Return the log-likelihood and most likely key of a sample, given probability table.'
+    ls, ks = findkey_batch(table, [histogram(s)])
+    return ls[0], ks[0]
+
+def findkey_batch(table, hs):
+    '''
+    Return the log-likelihoods and most likely keys of a sequence of histograms, given probability table, as an array
+    and a list, scoring every key of every histogram at once by loglikelihoods.
+    '''
+    ls = loglikelihoods(table, hs)
+    ks = ls.argmax(axis=1)
+    return ls[np.arange(len(ks)), ks], [freqs.keys[k] for k in ks]
+
+def findkey_slices(table, s):
+    'Return the log-likelihoods and most likely keys of each time slice of a sample, as findkey_batch.'
+    return findkey_batch(table, s.get_matrix()[0])
 
 def loglikelihood(table, h, k):
     'Return the log-likelihood of a histogram being in a particular key.'
-    if not isinstance(h, freqs.Freq):
+    if not isinstance(h, np.ndarray):
         h = histogram(h)
-    return sum(log(table.nfreq[True, freqs.Tone(n, k)]) * h[n] for n in h) + log(table.kprob(k))
+    return logpnk(table)[freqs.Key(k)].dot(h) + table.kprob(k, log=True)
 
-# TODO loglikelihood(table, hs) where hs.shape = (T,N) returning (T,K) matrix of probabilities
-# just matrix multiplication by a matrix with (n,k) entry set to log p(n|k)
+def loglikelihoods(table, hs):
+    'Return the TxK log-likelihoods of TxN histograms, an array or NoteMatrix, being in each key, by one matrix product.'
+    if isinstance(hs, freqs.NoteMatrix):
+        return hs.dot(logpnk(table).T) + logpk(table)
+    return np.dot(hs, logpnk(table).T) + logpk(table)
 
 def histogram(s):
     'Construct a pitch histogram for a sample.'
-    return s.get_matrix().sum(axis=0)
+    return s.get_matrix()[0].sum(axis=0)
+
+class RangeHistograms:
+    '''
+    Cumulative histograms of the time slices of a sample, built once, from which the histogram of any range of time
+    slices, time span or measure is the difference of two rows.
+    '''
+    def __init__(self, s):
+        m, self.ts = s.get_matrix()
+        if isinstance(m, freqs.NoteMatrix): # the cumulative histograms are dense anyway
+            m = m.toarray()
+        self.cumsum = np.vstack([np.zeros((1, m.shape[1])), m.cumsum(axis=0)]) # histograms of the first i slices
+        self.offsets = s.data.measures
+
+    def slices(self, i, j):
+        'Return the histogram of time slices i to j (exclusive), or the stacked histograms of arrays of them.'
+        return self.cumsum[j] - self.cumsum[i]
+
+    def span(self, t0, t1):
+        'Return the histogram of the time slices whose midpoints lie in [t0, t1), or of arrays of such spans.'
+        return self.slices(np.searchsorted(self.ts, t0), np.searchsorted(self.ts, t1))
+
+    def measures(self):
+        'Return the MxN array of the histograms of each measure.'
+        return self.span(self.offsets, np.append(self.offsets[1:], np.inf))
+
+def keycurve(table, s, width = 8.0):
+    '''
+    Return the midpoints of the time slices of a sample, along with the log-likelihood and most likely key of the
+    window of width quarter lengths centered on each, as findkey_batch, given probability table.
+    '''
+    h = RangeHistograms(s)
+    return h.ts, findkey_batch(table, h.span(h.ts - width / 2, h.ts + width / 2))
+
+DTYPE = np.float32 # of the cached tensors, halving their memory
+TENSORS = ['pk', 'pfm', 'pffm', 'ptfm', 'pnk']
+
+tensorcache = weakref.WeakKeyDictionary() # generation and tensors of each freqsarray environment, see tensors
+
+def lognorm(counts, axis):
+    'Return the logarithms of counts smoothed by adding one, normalized to sum to one along axis.'
+    counts = counts + 1.0
+    return np.log(counts) - np.log(counts.sum(axis=axis, keepdims=True))
+
+def tensors(table):
+    '''
+    Return a dictionary of the log probability tensors of a freqsarray environment, smoothed as its probabilities are:
+    the K array pk of ln p(k), the 2xF array pfm of ln p(f|m), the 2xFxF array pffm of ln p(f|f1,m) at [m,f1,f], the
+    2xFxT array ptfm of ln p(t|f,m) where m = minor,major, and the KxN array pnk of logpnk.
+    Computed from its Stats once for each generation of the environment, unless restored from its snapshot.
+    '''
+    generation, cached = tensorcache.get(table, (None, None))
+    if generation != table.generation:
+        s = table.stats
+        pfm = lognorm(s.cs + s.ts.sum(axis=1), 1) # initial chords and chords following a transition, as in cprob
+        pffm = lognorm(s.ts, 2)
+        pffm[:, np.arange(freqs.F), np.arange(freqs.F)] = pfm # staying on a chord, as in tprob
+        pn = lognorm(s.ns, 0)
+        settensors(table, {'pk' : lognorm(s.ks, 0), 'pfm' : pfm, 'pffm' : pffm,
+                           'ptfm' : lognorm(s.es, 1).transpose(0, 2, 1),
+                           'pnk' : np.array([freqs.transpose_tone(pn, k, False) for k in freqs.keys])})
+    return tensorcache[table][1]
+
+def settensors(table, ts):
+    'Cache a dictionary of tensors, as returned by tensors, for the current generation of a freqsarray environment.'
+    tensorcache[table] = table.generation, dict((name, np.asarray(t, DTYPE)) for name, t in ts.iteritems())
+
+# the following tables are sliced from the tensors of freqsarray environments, and looked up one entry at a time in
+# other environments, such as those of freqs
 
 def logpnk(table):
     'Return KxN table storing ln p(n|k).'
-    p = np.log(table.stats.ns + 1) - np.log((table.stats.ns+1).sum())
-    return np.array([freqs.transpose_tone(p, k, False) for k in freqs.keys])
+    return tensors(table)['pnk']
+
+def logpk(table, keys = freqs.keys):
+    'Return K table storing ln p(k) for the given keys.'
+    if isinstance(table, freqs.Env):
+        return tensors(table)['pk'][map(freqs.Key, keys)]
+    return np.array([table.kprob(k, log=True) for k in keys])
+
+def logpck(table, keys = freqs.keys):
+    'Return KxC table storing ln p(c|k) for the given keys and the triads in freqs.chords.'
+    if isinstance(table, freqs.Env):
+        pfm, fs = tensors(table)['pfm'], freqs.functable()
+        return np.array([pfm[freqs.Mode(k), fs[freqs.Key(k)]] for k in keys])
+    return np.array([[table.cprob(c, k, log=True) for c in freqs.chords] for k in keys])
 
-def logpcck(table):
-    'Return KxCxC table storing ln p(c|c1,k).'
-    
-    pass
+def logpcck(table, keys = freqs.keys):
+    'Return KxCxC table storing ln p(c|c1,k) at [k,c1,c] for the given keys and the triads in freqs.chords.'
+    if isinstance(table, freqs.Env):
+        pffm, fs = tensors(table)['pffm'], freqs.functable()
+        return np.array([pffm[freqs.Mode(k)][np.ix_(fs[freqs.Key(k)], fs[freqs.Key(k)])] for k in keys])
+    return np.array([[[table.tprob(c, c1, k, log=True) for c in freqs.chords] for c1 in freqs.chords] for k in keys])
 
-def logpnck(table):
-    'Return KxCxN table storing ln p(n|c,k).'
-    pass
+def logpnck(table, keys = freqs.keys, voice = None):
+    'Return KxCxN table storing ln p(n|c,k) for each absolute tone n, optionally in a voice, for the given keys.'
+    if isinstance(table, freqs.Env): # voices are not counted yet, as in nprob
+        ptfm, fs, ts = tensors(table)['ptfm'], freqs.functable(), freqs.tonetables()[1]
+        return np.array([ptfm[freqs.Mode(k)][np.ix_(fs[freqs.Key(k)], ts[freqs.Key(k)])] for k in keys])
+    pitches = map(freqs.Pitch, xrange(freqs.N))
+    return np.array([[[table.nprob(p, c, k, voice, log=True) for p in pitches] for c in freqs.chords] for k in keys])
 
 def logpffm(table):
     'Return 2xFxF table storing ln p(f|f1,m) where m = minor,major.'
-    pass
+    return tensors(table)['pffm']
 
 def logptfm(table):
     'Return 2xFxT table storing ln p(t|f,m) where m = minor,major.'
-    pass
+    return tensors(table)['ptfm']
 
 def findkeyks(s):
     'Return the most likely key of a sample, using the Krumhansl-Schmuckler algorithm.'
@@ -0,0 +1,73 @@
+### Load generator for the harmonization server
+
+# Usage: python loadgen.py [-p PORT] [-c CLIENTS] [-n REQUESTS] [-l LENGTH] [--command COMMAND] FILE...
+# Sends requests to a running server.py from concurrent clients, each sending its next request as soon as the last is
+# answered, for melodies of LENGTH notes taken from the top voice of the given score files in their detected keys,
+# then prints the throughput and latency percentiles seen by the clients along with the stats of the server.
+
+import argparse
+import json
+import threading
+import time
+import urllib2
+import cache
+
+def melodies(filenames, length = 16):
+    'Return a list of request bodies for consecutive melodies of length notes from the top voice of each file.'
+    bodies = []
+    for f in filenames:
+        data = cache.sample(f)
+        notes = [p.nameWithOctave for p in data.notes(0)[2]]
+        k = data.key('krumhansl')
+        tonic = k.tonic.name if k.mode == 'major' else k.tonic.name.lower()
+        for i in xrange(0, max(len(notes) - length, 0) + 1, length):
+            bodies.append({'notes' : notes[i:i+length], 'key' : tonic})
+    return bodies
+
+def request(port, path, body = None):
+    'Send a request to the server, returning the decoded response.'
+    data = json.dumps(body) if body is not None else None
+    return json.load(urllib2.urlopen('http://127.0.0.1:%d/%s' % (port, path), data))
+
+def load(port, bodies, clients = 8, requests = 1000, command = 'harmonize'):
+    '''
+    Send requests to the server from concurrent clients, cycling through bodies, returning the number of requests
+    answered per second and the 50th, 90th and 99th percentiles of their latencies in seconds.
+    '''
+    latencies, errors = [], []
+    def client(c):
+        for i in xrange(c, requests, clients):
+            start = time.time()
+            try:
+                request(port, command, bodies[i % len(bodies)])
+            except urllib2.URLError as e:
+                errors.append(e)
+            latencies.append(time.time() - start)
+    threads = [threading.Thread(target = client, args = (c,)) for c in xrange(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    return {'throughput' : requests / elapsed, 'errors' : len(errors),
+            'latency' : dict(('p%d' % p, latencies[min(len(latencies) * p / 100, len(latencies) - 1)])
+                             for p in [50, 90, 99])}
+
+def main(argv = None):
+    'Generate load from the command line, printing the results as JSON.'
+    p = argparse.ArgumentParser(description = 'Send concurrent requests to a running server.py.')
+    p.add_argument('files', nargs = '+', help = 'score files to take melodies from')
+    p.add_argument('-p', '--port', type = int, default = 8421, help = 'port of the server')
+    p.add_argument('-c', '--clients', type = int, default = 8, help = 'number of concurrent clients')
+    p.add_argument('-n', '--requests', type = int, default = 1000, help = 'total number of requests')
+    p.add_argument('-l', '--length', type = int, default = 16, help = 'number of notes of each melody')
+    p.add_argument('--command', default = 'harmonize', choices = ['harmonize', 'findkey'], help = 'request to send')
+    args = p.parse_args(argv)
+    results = load(args.port, melodies(args.files, args.length), args.clients, args.requests, args.command)
+    results['server'] = request(args.port, 'stats')
+    print json.dumps(results, indent = 1)
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 from music21 import *
+import cache
 # import key
 
 # key.loaddata()
@@ -37,11 +38,14 @@ class LSTMHarmonizer(nn.Module):
 
 class Sample:
     def __init__(self, filename):
-        self.s = converter.parse(filename)
-        self.cs = None
-        self.nhist = notehist(self.s)
-        self.key = self.s.analyze('key') # findkey(self.nhist)
-        self.notes = [None] * len(self.s.parts) # may be more complicated for other works
+        self.data = cache.sample(filename) # parsed only if not cached
+        self.nhist = torch.FloatTensor(Din).zero_()
+        for v in xrange(self.data.voices()):
+            _, durations, pitches = self.data.notes(v)
+            for l, p in zip(durations, pitches):
+                self.nhist[p.pitchClass] += l
+        self.key = self.data.key('key') # findkey(self.nhist)
+        self.notes = [None] * self.data.voices() # may be more complicated for other works
         self.chords = None
         
     # Implement these using __getattr__
@@ -59,19 +63,19 @@ class Sample:
     def getnotes(self, voice = None):
         # global mat
         if voice is None:
-            return [self.getnotes(v) for v in xrange(len(self.s.parts))]
+            return [self.getnotes(v) for v in xrange(len(self.notes))]
         if self.notes[voice] is None:
-            endtimes = self.s.flat.notesAndRests.stream()._uniqueOffsetsAndEndTimes(endTimesOnly=True)
+            endtimes = self.data.endtimes
             self.notes[voice] = [None] * len(endtimes)
-            notes = list(self.s.parts[voice].flat.notesAndRests)
+            offsets, durations, pitches = self.data.notes(voice, rests = True) # pitches of rests are None
             j = 0 # index of current note
             curr = 0.0
             for i in xrange(len(endtimes)):
-                self.notes[voice][i] = map(lambda k: (isinstance(notes[j], note.Note) and \
-                                           k == pitchtoid(notes[j].pitch, self.key)) * \
+                self.notes[voice][i] = map(lambda k: (pitches[j] is not None and \
+                                           k == pitchtoid(pitches[j], self.key)) * \
                                            (endtimes[i] - curr), range(Din))
                 # if current note ends here, go to next note
-                if endtimes[i] == notes[j].offset + notes[j].quarterLength:
+                if endtimes[i] == offsets[j] + durations[j]:
                     j += 1
                 curr = endtimes[i]
             self.notes[voice] = torch.FloatTensor(self.notes[voice])
@@ -81,12 +85,11 @@ class Sample:
     
     def getchords(self):
         if self.chords is None:
-            self.cs = self.s.chordify()
             self.chords = []
-            for c in self.cs.flat.notesAndRests:
+            for c in self.data.chords(rests = True): # rests are None
                 self.chords.append(
-                    map(lambda k: (isinstance(c, chord.Chord) and \
-                        k == chordtoid(c, self.key)) * float(c.quarterLength), range(Dout)))
+                    map(lambda k: (c is not None and \
+                        k == chordtoid(c, self.key)) * float(c.quarterLength if c else 0), range(Dout)))
             self.chords = torch.FloatTensor(self.chords)
         return self.chords
 
@@ -1,13 +1,133 @@
 ### Command line interface for functions
 
+# Usage: python main.py COMMAND [options] PATH...
+# where COMMAND is one of harmonize, findkey or modulation, and each PATH is a score file, a directory of
+# score files or a glob pattern. The model used by the command is loaded once, from its snapshot if one has been saved,
+# and the files are processed in a pool of worker processes, writing a JSON object with the result for each file and
+# the time taken to standard output as soon as the file is done.
+
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from music21 import key
+import cache
 import freqs
+import freqsarray
 import harmonize
-import error
-import enharmonic
-import voice
+import histarray
+import modulation
+
+EXTENSIONS = ['.xml', '.mxl', '.musicxml', '.krn', '.mid', '.midi', '.abc'] # of score files in directories
+
+def files(paths):
+    'Iterate through the distinct score files given by a list of files, directories and glob patterns, in order.'
+    for path in freqsarray.unique(itertools.chain.from_iterable(expand(p) for p in paths)):
+        yield path
+
+def expand(path):
+    'Iterate through the score files given by a file, directory or glob pattern.'
+    if os.path.isdir(path):
+        for root, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                    yield os.path.join(root, name)
+    elif os.path.exists(path):
+        yield path
+    else:
+        for p in sorted(glob.glob(path)):
+            for f in expand(p):
+                yield f
+
+def keyof(data, name):
+    "Return the key given by name, a tonic such as F or g (minor), 'infer' for None or 'detect' for that of the data."
+    if name == 'infer':
+        return None
+    if name == 'detect':
+        return data.key('krumhansl')
+    return key.Key(name)
+
+def harmonizefile(filename, args):
+    'Harmonize the notes of a voice of a score.'
+    data = cache.sample(filename)
+    notes = data.notes(args.voice)[2]
+    k, chords, p = harmonize.harmonize(notes, keyof(data, args.key), args.voice, beam = args.beam)
+    return {'key' : str(k), 'chords' : [c.pitchedCommonName for c in chords], 'logprob' : float(p)}
+
+def findkeyfile(filename, args):
+    'Find the likeliest key of a score from its pitch histogram.'
+    l, k = histarray.findkey(freqsarray.gettable(), freqsarray.Sample(filename))
+    return {'key' : str(k), 'loglikelihood' : float(l)}
+
+def modulationfile(filename, args):
+    'Divide a score into regions in different keys.'
+    table, s = freqsarray.gettable(), freqsarray.Sample(filename)
+    if args.method == 'em':
+        regions = modulation.modulation(table, s, args.regions)
+    else:
+        regions = modulation.segment(table, s, args.penalty, args.regions if args.method == 'partition' else None)
+    return {'regions' : [[t0, t1, str(k)] for t0, t1, k in sorted(regions.values())]}
+
+# function processing each file and function returning the model it uses, for each command, leaving out enharmonic
+# correction until enharmonic.correct_enharm can process scores
+COMMANDS = {'harmonize'  : (harmonizefile, freqs.gettable),
+            'findkey'    : (findkeyfile, freqsarray.gettable),
+            'modulation' : (modulationfile, freqsarray.gettable)}
+
+def run(job):
+    'Process a file for a command, returning its result along with the filename and the time taken, or the error raised.'
+    command, filename, args = job
+    start = time.time()
+    try:
+        result = COMMANDS[command][0](filename, args)
+    except Exception as e:
+        result = {'error' : '%s: %s' % (type(e).__name__, e)}
+    result.update(file = filename, seconds = time.time() - start)
+    return result
 
-# 1. Take input from file or user
+def parser():
+    'Return the parser of the command line arguments.'
+    p = argparse.ArgumentParser(description = 'Harmonize melodies and find keys and modulation in score files, '
+                                              'writing a JSON object for each file.')
+    p.add_argument('-w', '--workers', type = int, default = 1, help = 'number of worker processes')
+    commands = p.add_subparsers(dest = 'command')
+    for name, (f, _) in sorted(COMMANDS.iteritems()):
+        c = commands.add_parser(name, help = f.__doc__)
+        c.add_argument('paths', nargs = '+', help = 'score files, directories or glob patterns')
+        if name == 'harmonize':
+            c.add_argument('-k', '--key', default = 'detect',
+                           help = "tonic of the key, lowercase for minor, 'infer' or 'detect' (default)")
+            c.add_argument('-v', '--voice', type = int, default = 0, help = 'voice to harmonize, by default the top')
+            c.add_argument('-b', '--beam', type = int, help = 'beam width, by default unpruned')
+        if name == 'modulation':
+            c.add_argument('-r', '--regions', type = int, default = 4, help = 'maximum number of regions')
+            c.add_argument('-m', '--method', default = 'em', choices = ['em', 'viterbi', 'partition'],
+                           help = 'EM (default), the likeliest keys of the measures or the likeliest regions')
+            c.add_argument('-p', '--penalty', type = float, default = 20.0,
+                           help = 'log-likelihood cost of each change of key for viterbi')
+    return p
 
-# 2. Call desired function on input, specifying type of output (show, save to file, etc.)
+def main(argv = None):
+    'Run the command line interface on a list of arguments, by default sys.argv[1:].'
+    args = parser().parse_args(argv)
+    COMMANDS[args.command][1]() # load the model once, before the worker processes are forked
+    jobs = [(args.command, f, args) for f in files(args.paths)]
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        results = pool.imap_unordered(run, jobs)
+    else:
+        results = itertools.imap(run, jobs)
+    try:
+        for result in results: # in order of completion
+            sys.stdout.write(json.dumps(result) + '\n')
+            sys.stdout.flush()
+    finally:
+        if args.workers > 1:
+            pool.terminate()
 
-# 3. Display result
+if __name__ == '__main__':
+    main()
@@ -1,59 +1,184 @@
-## Recognizing modulation using EM
+## Recognizing modulation using EM, or exactly by dynamic programming
 # The goal is to separate a piece of music into k regions such that each region is in a different key.
 # P(r|(n_t)) = Z^-1 P(r) P(t|r) sum(P(k|r) P(n_t|t, k), k) ~ Z^-1 P(r) P(t|r) P(n_t|t, k_max)
 # P(t|r) is approximated as a normal distribution with variable mean but common variance.
 # The region boundaries are controlled by the region means and weights, which provides cleaner and wider decision boundaries.
 # The most likely key within a region is optimized by looking at the histogram of the region.
 
-from histogram import *
+# Time is measured in measures. The key log-likelihoods of the measures of every sample are computed at once by one
+# matrix product, and each EM iteration updates a TxR array of responsibilities, normalized in log space. The key of
+# each region is the likeliest for the histograms of the measures weighted by their responsibilities, so that no
+# iteration decreases the log-likelihood of the mixture, and iteration stops once it converges.
+# segment finds the globally likeliest keys of the measures instead, deterministically: either the likeliest sequence of
+# keys where changing key costs a fixed penalty, by the Viterbi algorithm over K states, or the likeliest division into
+# at most n regions, from the log-likelihoods of all ranges of measures.
+
+import numpy as np
+import freqsarray
+import histarray
 from math import *
-from itertools import chain
 
-def modulation(table, s, n):
+def modulation(table, s, n, tol = 1e-6, iterations = 100):
+    '''
+    Identify modulation in a sample s by dividing it into at most n regions, returning a dictionary from each region
+    to its first and last measure (exclusive, possibly fractional) and its most likely key.
+    '''
+    return modulations(table, [s], n, tol, iterations)[0]
+
+def modulations(table, samples, n, tol = 1e-6, iterations = 100):
+    'Identify modulation in each of a list of samples, as modulation, scoring the measures of all of them at once.'
+    lss, lk = loglikelihoods(table, samples)
+    return [em(ls, lk, n, tol, iterations) for ls in lss]
+
+def loglikelihoods(table, samples):
     '''
-    Identify modulation in a sample s by dividing it into at most n regions.
+    Return the list of the TxK log-likelihoods of the notes of each measure of each of a list of samples being in each
+    key, without the prior, computed by a single matrix product, along with the K log priors of the keys.
     '''
-    w = {}          # w[t, r] corresponds to the weight of time t for region r
-    c = [1.0/n] * n # c[r] corresponds to the class weight of region r
-    m = [1] * n     # m[r] corresponds to the class mean of region r
-    k = [None] * n  # k[r] corresponds to the most likely key for region r
-    v = 1           # v is the common class variance, initially irrelevant and set to 1
-    ms = list(list(m.notes) for m in s.measures()) # list of measures, simplify later
-    hs = map(histogram, hs) # histograms of each measure
-    l = len(ms)     # total duration of sample
+    hs = [histarray.RangeHistograms(s).measures() for s in samples]
+    ls = np.dot(np.concatenate(hs), histarray.logpnk(table).T)
+    return np.split(ls, np.cumsum(map(len, hs))[:-1]), histarray.logpk(table)
+
+def em(ls, lk, n, tol = 1e-6, iterations = 100):
+    '''
+    Divide a sequence of measures into at most n regions in different keys with the EM algorithm, given the TxK
+    log-likelihoods ls of the notes of each measure in each key and the K log priors lk of the keys, iterating until
+    the log-likelihood of the mixture increases by less than tol, or at most iterations times. Neighbouring regions
+    which end up in the same key are merged, and empty regions dropped.
+    '''
+    l = len(ls)
+    if not l:
+        return {}
+    t = np.arange(l)
+    c = np.ones(n) / n            # c[r] corresponds to the class weight of region r
+    m = (np.arange(n) + 0.5) * l / n # m[r] corresponds to the class mean of region r, initially dividing evenly
+    v = 1.0                       # v is the common class variance, initially irrelevant and set to 1
     
-    # initially, divide sample evenly
-    for r in xrange(n):
-        m[r] = (r + 0.5) * l / n
+    # initially, the key of each region is the likeliest key of its measures
+    cum = np.vstack([np.zeros((1, ls.shape[1])), ls.cumsum(axis=0)]) # log-likelihoods of the first i measures
+    start, end = [np.clip(np.ceil([b[i] for _, b in sorted(boundaries(c, m, sqrt(2 * v), l).items())]), 0, l)
+                  .astype(int) for i in (0, 1)]
+    k = (cum[end] - cum[start] + lk).argmax(axis=1)
     
-    # loop until convergence
-    ls = b = None
-    for _ in xrange(10): # TODO better condition, such as regions not changing
-        # find b[r] from c[r] and m[r]
-        b1, b = b, boundaries(c, m, v, l)
-        lp, ls = ls, 0
-        for r in b:
-            # calculate k[r] from b[r]
-            # Stream.measures too slow, creating new object
-            lk, k[r] = findkey(table, chain(*ms[b[r][0]:b[r][1]])) # or perhaps compute k[r] from matrix product of s and w
-            ls += lk
-        # break if likelihood decreases
-        if lp and ls <= lp:
-            return b1
-        # calculate weights
-        for t in xrange(l):
-            rs = list(exp(-(t-m[r]) ** 2 / v + log(c[r]) + loglikelihood(table, hs[t], k[r])) for r in b)
-            # rm = max(b, lambda r: rs[r])
-            rsum = sum(rs[r] for r in b)
-            for r in b:
-                w[t, r] = rs[r] / rsum # float(r == rm) # approximation for rs[r] / rsum
-        # update parameters
-        for r in b:
-            c[r] = sum(w[t,r] for t, r1 in w if r == r1) / sum(w[t,r1] for t, r1 in w if r in b)
-            m[r] = sum(t * w[t,r] for t, r1 in w if r == r1) / sum(w[t,r] for t, r1 in w if r == r1)
-        # MLE estimate of variance is weighted average of class variances, here modified for no bias
-        v = sum(c[r] * sum((t - m[r]) ** 2 * w[t,r] for t in xrange(l)) / (sum(w[t,r] for t in xrange(l)) - 1) for r in b)
-    return boundaries(c, m, v, l)
+    lp = -np.inf
+    for _ in xrange(iterations):
+        # calculate the weights of the regions for each measure, and the log-likelihood of the mixture
+        lw = -(t[:,None] - m) ** 2 / (2 * v) + np.log(c) + ls[:,k] + lk[k]
+        top = lw.max(axis=1)[:,None]
+        w = np.exp(lw - top)
+        sw = w.sum(axis=1)[:,None]
+        ll = (top + np.log(sw)).sum() - l * log(2 * pi * v) / 2
+        if ll < lp + tol: # converged, as EM never decreases the log-likelihood
+            break
+        lp = ll
+        w /= sw
+        
+        # update parameters, of the regions which still have weight
+        sw = w.sum(axis=0)
+        live = sw > 0
+        w, sw, c, m, k = w[:,live], sw[live], c[live], m[live], k[live]
+        c = sw / sw.sum()
+        m = t.dot(w) / sw
+        v = max((((t[:,None] - m) ** 2) * w).sum() / l, 1e-9) # MLE estimate of the common variance
+        k = (w.T.dot(ls) + sw[:,None] * lk).argmax(axis=1) # likeliest key of the measures weighted by the region
+    
+    # find the boundaries of the regions, whose discriminants are those of lw times 2v, then merge neighbouring regions
+    # in the same key, keeping the first, and drop empty regions
+    b = boundaries(c, m, sqrt(2 * v), l)
+    regions = {}
+    last = None
+    for r in sorted(b, key = b.get):
+        t0, t1 = b[r]
+        if ceil(t1) <= ceil(t0) and t1 < l:
+            continue
+        if last is not None and regions[last][2] == k[r]:
+            regions[last] = regions[last][0], t1, k[r]
+        else:
+            regions[r], last = (t0, t1, k[r]), r
+    return dict((r, (t0, t1, freqsarray.keys[kr])) for r, (t0, t1, kr) in regions.iteritems())
+
+# Exact alternatives to EM, finding the globally likeliest keys of the measures by dynamic programming
+
+def segment(table, s, penalty = 20.0, n = None):
+    '''
+    Divide a sample s into regions in different keys, returning the same as modulation. The regions are those of the
+    likeliest sequence of keys of its measures, as given by keypath, where each change of key costs penalty in
+    log-likelihood, or if n is given, the likeliest division into at most n regions, as given by partition.
+    '''
+    return segments(table, [s], penalty, n)[0]
+
+def segments(table, samples, penalty = 20.0, n = None):
+    'Divide each of a list of samples into regions in different keys, as segment, scoring their measures at once.'
+    lss, lk = loglikelihoods(table, samples)
+    results = []
+    for ls in lss:
+        if not len(ls):
+            results.append({})
+        elif n is None:
+            ks = keypath(ls, lk, penalty)[0]
+            starts = np.concatenate([[0], (ks[1:] != ks[:-1]).nonzero()[0] + 1])
+            ends = np.append(starts[1:], len(ks))
+            results.append(dict((r, (int(i), int(j), freqsarray.keys[ks[i]]))
+                                for r, (i, j) in enumerate(zip(starts, ends))))
+        else:
+            results.append(dict((r, (int(i), int(j), freqsarray.keys[k]))
+                                for r, (i, j, k) in enumerate(partition(ls, lk, n)[0])))
+    return results
+
+def keypath(ls, lk, penalty):
+    '''
+    Return the likeliest sequence of keys of a sequence of measures as an array of indices in freqsarray.keys, along
+    with its log-likelihood, given the TxK log-likelihoods ls of each measure in each key and the K log priors lk of
+    the keys, where each change of key costs penalty, by the Viterbi algorithm.
+    The best predecessor of a key is either the same key or the overall best one, so each measure takes O(K) time.
+    '''
+    l, k = ls.shape
+    probs = lk + ls[0]
+    preds = np.empty((l, k), int)
+    for t in xrange(1, l):
+        best = probs.argmax()
+        switch = probs[best] - penalty
+        preds[t] = np.where(probs >= switch, np.arange(k), best)
+        probs = np.maximum(probs, switch) + ls[t]
+    path = [probs.argmax()]
+    for t in xrange(l - 1, 0, -1):
+        path.append(preds[t, path[-1]])
+    return np.array(path[::-1]), probs.max()
+
+def partition(ls, lk, n):
+    '''
+    Return the likeliest division of a sequence of measures into at most n regions, each in its likeliest key, as a
+    list of the first and last measure (exclusive) and the index in freqsarray.keys of the key of each region, along
+    with its log-likelihood, given ls and lk as for keypath.
+    The log-likelihood of each range of measures in each key is a difference of prefix sums, taking O(T^2 K) time in
+    total, after which the regions are found in O(n T^2) time by dynamic programming.
+    '''
+    l = len(ls)
+    cum = np.vstack([np.zeros((1, ls.shape[1])), ls.cumsum(axis=0)])
+    scores = np.full((l + 1, l + 1), -np.inf) # of the likeliest key of measures i to j, at [i,j] where i < j
+    keys = np.zeros((l + 1, l + 1), int)
+    for j in xrange(1, l + 1): # one column at a time, keeping the memory used O(T K)
+        spans = cum[j] - cum[:j] + lk
+        keys[:j,j] = spans.argmax(axis=1)
+        scores[:j,j] = spans.max(axis=1)
+    best = np.full(l + 1, -np.inf) # log-likelihood of the first j measures in the regions found so far
+    best[0] = 0
+    preds = []
+    results = []
+    for _ in xrange(n):
+        candidates = best[:,None] + scores
+        preds.append(candidates.argmax(axis=0))
+        best = candidates.max(axis=0)
+        best[0] = -np.inf
+        results.append(best[l])
+    # backtrack from the number of regions with the greatest log-likelihood
+    m = int(np.argmax(results))
+    regions, j = [], l
+    for r in xrange(m, -1, -1):
+        i = preds[r][j]
+        regions.append((i, j, keys[i, j]))
+        j = i
+    return regions[::-1], results[m]
 
 def boundaries(c, m, s, l):
     'Calculate region boundaries from region means and weights.'
@@ -71,10 +196,11 @@ def boundaries(c, m, s, l):
     # find most likely region in the beginning, hopefully region 0
     r = max(xrange(n), key = lambda r: discr(t, r))
     while t < l:
-        # find the region first to overcome the discriminant of the current region and set it to the next region
+        # find the region first to overcome the discriminant of the current region and set it to the next region,
+        # which has to increase faster, as rounding may place the intersection with the previous region after t
         # perhaps optimize this through dynamic programming
         try:
-            t1, r1 = min(((intersect(r, r1), r1) for r1 in xrange(n) if r != r1 and intersect(r, r1) > t))
+            t1, r1 = min(((intersect(r, r1), r1) for r1 in xrange(n) if m[r1] > m[r] and intersect(r, r1) > t))
         except ValueError: # empty iterator
             t1, r1 = l, r
         b[r] = t, t1
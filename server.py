@@ -0,0 +1,213 @@
+### Local harmonization server with micro-batching
+
+# Usage: python server.py [-p PORT] [-w WINDOW] [-s SIZE] [-b BEAM] [-k KEY...] [-v VOICE...]
+# Serves JSON requests over HTTP on localhost, keeping the models and the tables computed from them in memory:
+#   POST /harmonize {"notes" : ["F4", "G4", ...], "key" : "F", "voice" : 0}  ->  {"key", "chords", "logprob"}
+#   POST /findkey   {"notes" : ["F4", "G4", ...], "durations" : [1, 0.5, ...]}  ->  {"key", "loglikelihood"}
+#   GET  /stats  ->  number of requests and batches, queue depth and latency percentiles in seconds
+# where key, voice and durations are optional, keys being given by their tonic, lowercase for minor.
+# The threads handling connections queue their requests for a single worker thread, which waits up to WINDOW seconds
+# after the first request of a batch for up to SIZE requests, then harmonizes their melodies with harmonize_batch and
+# finds their keys with a single matrix product, so that concurrent requests share the vectorized Viterbi algorithm.
+# The tables of the harmonizer are built before serving, for the given keys (by default all of them, as requests
+# without a key are harmonized in every key) in the given voices besides requests without a voice.
+
+import argparse
+import json
+import threading
+import time
+import BaseHTTPServer
+import Queue
+import SocketServer
+from collections import deque
+import numpy as np
+from music21 import key, pitch
+import freqs
+import freqsarray
+import frequtils
+import harmonize
+import histarray
+
+LATENCIES = 1 << 14 # number of most recent request latencies kept for the percentiles
+
+class Request:
+    'Request waiting to be run in a batch, along with its result or error once done is set.'
+    def __init__(self, command, body):
+        self.command, self.body = command, body
+        self.start = time.time()
+        self.done = threading.Event()
+        self.result = self.error = None
+
+class Batcher:
+    'Queue of requests, run in batches by a worker thread.'
+    def __init__(self, window = 0.005, size = 64, beam = None):
+        self.window, self.size, self.beam = window, size, beam
+        self.queue = Queue.Queue()
+        self.latencies = deque(maxlen = LATENCIES)
+        self.requests = self.batches = 0
+        self.lock = threading.Lock()
+        worker = threading.Thread(target = self.run)
+        worker.daemon = True
+        worker.start()
+
+    def submit(self, command, body):
+        'Queue a request and return its result once run, raising the error of invalid requests.'
+        r = Request(command, body)
+        self.queue.put(r)
+        while not r.done.wait(1): # with a timeout, so that the server can be interrupted
+            pass
+        with self.lock:
+            self.latencies.append(time.time() - r.start)
+        if r.error:
+            raise r.error
+        return r.result
+
+    def batch(self):
+        'Return the next batch of requests, waiting up to window seconds after the first for up to size of them.'
+        batch = [self.queue.get()]
+        end = time.time() + self.window
+        while len(batch) < self.size and time.time() < end:
+            try:
+                batch.append(self.queue.get(timeout = end - time.time()))
+            except Queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        'Run batches of requests as they arrive.'
+        while True:
+            batch = self.batch()
+            for command, (parse, run) in COMMANDS.iteritems():
+                valid = []
+                for r in batch:
+                    if r.command == command:
+                        try:
+                            r.args = parse(r.body)
+                            valid.append(r)
+                        except Exception as e:
+                            r.error = ValueError('invalid request: %s' % e)
+                try:
+                    if valid:
+                        run(valid, self.beam)
+                except Exception as e:
+                    for r in valid:
+                        r.error = e
+            with self.lock:
+                self.requests += len(batch)
+                self.batches += 1
+            for r in batch:
+                r.done.set()
+
+    def stats(self):
+        'Return the number of requests and batches run, the queue depth and latency percentiles in seconds.'
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {'requests' : self.requests, 'batches' : self.batches, 'queue' : self.queue.qsize()}
+        stats['latency'] = dict(('p%d' % p, latencies[min(len(latencies) * p / 100, len(latencies) - 1)])
+                                for p in [50, 90, 99] if latencies)
+        return stats
+
+def parsenotes(body):
+    'Return the pitches of the notes of a request.'
+    notes = [pitch.Pitch(n) for n in body['notes']]
+    if not notes:
+        raise ValueError('no notes')
+    return notes
+
+def parseharmonize(body):
+    'Return the notes, key and voice of a harmonize request.'
+    return parsenotes(body), key.Key(body['key']) if body.get('key') else None, body.get('voice')
+
+def parsefindkey(body):
+    'Return the histogram of absolute tones of a findkey request, weighted by the durations of the notes if given.'
+    tones = np.array([freqsarray.Tone(n) for n in parsenotes(body)])
+    durations = np.array(body.get('durations') or [1.0] * len(tones), float)
+    if len(durations) != len(tones):
+        raise ValueError('%d durations for %d notes' % (len(durations), len(tones)))
+    return np.bincount(tones[tones >= 0], durations[tones >= 0], freqsarray.N)
+
+def runharmonize(requests, beam):
+    'Harmonize the melodies of a batch of requests.'
+    melodies, keys, voices = zip(*[r.args for r in requests])
+    for r, (k, chords, p) in zip(requests, harmonize.harmonize_batch(melodies, list(keys), list(voices), beam = beam)):
+        r.result = {'key' : str(k), 'chords' : [c.pitchedCommonName for c in chords], 'logprob' : float(p)}
+
+def runfindkey(requests, beam):
+    'Find the keys of the histograms of a batch of requests, scoring every key of every histogram at once.'
+    ls, ks = histarray.findkey_batch(freqsarray.gettable(), [r.args for r in requests])
+    for r, l, k in zip(requests, ls, ks):
+        r.result = {'key' : str(k), 'loglikelihood' : float(l)}
+
+# functions parsing the body of each request and running a batch of them, for each command
+COMMANDS = {'harmonize' : (parseharmonize, runharmonize),
+            'findkey'   : (parsefindkey, runfindkey)}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    'Handler of the HTTP requests of the server.'
+    def do_GET(self):
+        if self.path == '/stats':
+            self.reply(200, self.server.batcher.stats())
+        else:
+            self.reply(404, {'error' : 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        command = self.path.strip('/')
+        if command not in COMMANDS:
+            return self.reply(404, {'error' : 'unknown path %s' % self.path})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            self.reply(200, self.server.batcher.submit(command, body))
+        except ValueError as e:
+            self.reply(400, {'error' : str(e)})
+        except Exception as e:
+            self.reply(500, {'error' : '%s: %s' % (type(e).__name__, e)})
+
+    def reply(self, code, result):
+        'Send a JSON response.'
+        data = json.dumps(result)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # logging every request would dominate the time spent on small ones
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    'HTTP server handling each connection in a thread, sharing a Batcher.'
+    daemon_threads = True
+
+    def __init__(self, port = 8421, window = 0.005, size = 64, beam = None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.batcher = Batcher(window, size, beam)
+
+def warm(keys = frequtils.keys, voices = [None]):
+    'Build the tables of the harmonizer in the given keys and voices, so that no batch waits for them.'
+    for k in keys:
+        for v in voices:
+            harmonize.candidates(k, 0, v) # building the tables along with the candidate chords of every tone
+
+def main(argv = None):
+    'Load the models and serve requests until interrupted.'
+    p = argparse.ArgumentParser(description = 'Serve harmonize and findkey requests over HTTP on localhost.')
+    p.add_argument('-p', '--port', type = int, default = 8421, help = 'port to listen on')
+    p.add_argument('-w', '--window', type = float, default = 0.005, help = 'seconds to wait for requests to batch')
+    p.add_argument('-s', '--size', type = int, default = 64, help = 'maximum number of requests in a batch')
+    p.add_argument('-b', '--beam', type = int, help = 'beam width of the harmonizer, by default unpruned')
+    p.add_argument('-k', '--keys', nargs = '+', default = [],
+                   help = 'tonics of the keys to build the tables of, lowercase for minor, by default every key')
+    p.add_argument('-v', '--voices', nargs = '+', type = int, default = [],
+                   help = 'voices to build the tables of, besides requests without a voice')
+    args = p.parse_args(argv)
+    freqs.gettable()
+    freqsarray.gettable()
+    warm(map(key.Key, args.keys) or frequtils.keys, [None] + args.voices)
+    server = Server(args.port, args.window, args.size, args.beam)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+### Saving and loading trained models as directories of NumPy arrays
+
+# A snapshot is a directory containing one .npy file for each array of a model, memory-mapped when loaded, along with
+# a manifest.json file recording the format version, the type of model, the names of the arrays and the filenames and
+# content hashes of the samples the model was trained on.
+
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+from music21 import key
+
+VERSION = 1
+
+# directory of the snapshots of shared models
+DIRECTORY = os.environ.get('HARMONIZER_MODELS', os.path.join(os.path.expanduser('~'), '.harmonizer'))
+
+models = {} # shared models by name, see model
+
+def save(path, model, arrays, samples, **kwargs):
+    '''
+    Save a dictionary of arrays along with a manifest to directory path, for the given model type and samples, a
+    dictionary from filenames to content hashes (which are computed if None). Extra keyword arguments are stored in
+    the manifest. The snapshot is written to a temporary directory next to path, which then replaces path, so that an
+    existing snapshot, possibly memory-mapped by the model being saved, is never overwritten in place.
+    '''
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp = tempfile.mkdtemp('.tmp', '.' + os.path.basename(path) + '.', parent)
+    try:
+        os.chmod(tmp, 0755)
+        for name, a in arrays.iteritems():
+            np.save(os.path.join(tmp, name + '.npy'), a)
+        manifest = dict(kwargs, version = VERSION, model = model, arrays = sorted(arrays),
+                        samples = [{'filename' : f, 'sha1' : h or filehash(f)} for f, h in sorted(samples.iteritems())])
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        if os.path.exists(path):
+            # files of the old snapshot stay valid while mapped, even once removed
+            os.rename(path, tmp + '.old')
+            os.rename(tmp, path)
+            shutil.rmtree(tmp + '.old')
+        else:
+            os.rename(tmp, path)
+    except:
+        shutil.rmtree(tmp, ignore_errors = True)
+        raise
+
+def load(path, model):
+    '''
+    Load the manifest and arrays of a snapshot of the given model type from directory path. Arrays are memory-mapped
+    copy-on-write, so that loaded models can be trained further without modifying the snapshot.
+    '''
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['version'] != VERSION:
+        raise ValueError('snapshot %s has version %s, expected %s' % (path, manifest['version'], VERSION))
+    if manifest['model'] != model:
+        raise ValueError('snapshot %s stores a %s model, expected %s' % (path, manifest['model'], model))
+    arrays = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode = 'c')) for name in manifest['arrays'])
+    return manifest, arrays
+
+def model(name, cls, filenames):
+    '''
+    Return the shared model of the given name and type cls, loading it from its snapshot in DIRECTORY on first use,
+    or training it on filenames() and saving its snapshot if there is none.
+    '''
+    if name not in models:
+        path = os.path.join(DIRECTORY, name)
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            models[name] = cls.load(path)
+        else:
+            m = cls()
+            m.train(filenames())
+            m.save(path)
+            models[name] = m
+    return models[name]
+
+def samples(manifest):
+    'Return a dictionary from the filenames of the samples of a manifest to their content hashes.'
+    return dict((s['filename'], s['sha1']) for s in manifest['samples'])
+
+def validate(manifest):
+    'Return the filenames of the samples of a manifest which no longer exist or whose contents have changed.'
+    return [s['filename'] for s in manifest['samples']
+            if not os.path.exists(s['filename']) or filehash(s['filename']) != s['sha1']]
+
+def filehash(filename):
+    'Return the SHA-1 hash of the contents of a file.'
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# Interned code tables are stored as arrays of JSON strings
+
+def encode(values, tuples = {}):
+    '''
+    Encode a sequence of values, such as Func, Tone, Key, Sample or voice values, as an array of JSON strings.
+    tuples maps names to tuple subclasses to be recorded by name, e.g. {'func' : Func, 'tone' : Tone}.
+    '''
+    def enc(v):
+        for name, cls in tuples.iteritems():
+            if isinstance(v, cls):
+                return {name : map(enc, v)}
+        if isinstance(v, key.Key):
+            return {'key' : [v.tonic.name, v.mode]}
+        if hasattr(v, 'filename'): # samples are identified by their filenames
+            return {'sample' : v.filename}
+        if isinstance(v, tuple):
+            return {'tuple' : map(enc, v)}
+        if isinstance(v, np.generic):
+            return v.item()
+        return v
+    return np.array([json.dumps(enc(v)) for v in values], dtype = str)
+
+def decode(strings, tuples = {}):
+    'Decode an array of JSON strings created by encode into a list of values.'
+    def dec(v):
+        if isinstance(v, unicode):
+            return str(v)
+        if not isinstance(v, dict):
+            return v
+        (name, v), = v.items()
+        if name == 'key':
+            return key.Key(str(v[0]), str(v[1]))
+        if name == 'sample':
+            return str(v)
+        if name == 'tuple':
+            return tuple(map(dec, v))
+        return tuple.__new__(tuples[name], map(dec, v))
+    return [dec(json.loads(s)) for s in strings]
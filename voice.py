@@ -72,7 +72,7 @@ class VoiceEnv(Env):
     def voiceleading(self, chords, key, melody = None):
     	'Generate voice leading for a sequence of chords, optionally accompanying a melody.'
         # Viterbi algorithm
-        probs  = defaultdict(Prob)
+        probs  = defaultdict(LogProb) # voicing probabilities are multiplied in log space
         preds  = {}
         length = len(chords)
         
@@ -80,7 +80,7 @@ class VoiceEnv(Env):
             probs[ns, 0] = p
         
         for i in xrange(1, length):
-            bestprob = Prob()
+            bestprob = LogProb()
             best = None
             for ns, _ in self.voicings(chords[i], k):
                 # find max and arg max of transition